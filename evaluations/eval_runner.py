@@ -0,0 +1,383 @@
+'''
+Asynchronous evaluation runner: asks every model whether every test sentence is grammatical, `trials` times each
+
+The evaluation behind stats_per_question.csv is 4 models x 3 tiers x 50 questions x 100 trials = 60,000 requests;
+one at a time that takes days. This runner sends them concurrently with asyncio, separately for each model:
+
+    requests_per_second / burst     token-bucket rate limit of the model's endpoint
+    max_concurrency                 requests in flight at once
+    max_retries                     retries of a request answered with 429 or 5xx (or that times out or fails to
+                                    connect), after exponential backoff with jitter, or after Retry-After if given
+
+Every answer is appended to a JSONL file as it arrives (one line per model, tier, question and trial), so an
+interrupted run keeps what it has and a rerun on the same file only sends the missing requests. summarise() turns the
+file into per-question acceptance rates in the layout of stats_per_question.csv, and write_stats() into the
+per-tier statistics of stats.csv.
+
+With --cache, responses are kept in a ResponseCache (response_cache.py) and a request answered before is not sent
+again; with --replay as well, nothing is sent at all and requests missing from the cache are reported as failed.
+
+Endpoints speak the OpenAI-compatible chat-completions protocol (POST {base_url}/chat/completions). Models are given
+as a JSON list of endpoint settings (see ModelEndpoint), or with --mock the runner starts mock_server.py locally and
+evaluates four stand-in models against it, which needs no network or API key:
+
+    python eval_runner.py --mock --trials 5 --out results.jsonl
+    python eval_runner.py --models models.json --trials 100 --out results.jsonl --summary stats_per_question_new.csv
+    python eval_runner.py --models models.json --cache responses.db --replay --out replay.jsonl --stats stats_new.csv
+
+Standard library only (HTTP calls run in a thread pool, since aiohttp is not a dependency).
+'''
+
+import argparse
+import asyncio
+import csv
+import json
+import math
+import os
+import random
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from response_cache import ResponseCache
+
+
+TEST_SENTENCES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sentence-generation", "test_sentences")
+TIERS = {"cf": "Context-Free", "ix": "Mildly Context-Sensitive", "cs": "Context-Sensitive"}
+AUTOMATA = {"cf": "PDA", "ix": "HOPDA", "cs": "LBA"}  # the columns of stats.csv
+PROMPT = "Is the following sentence grammatically correct? Answer only yes or no.\n\n{sentence}"
+MOCK_MODELS = ["o1", "o1-preview", "gpt-4", "claude-o"]
+
+
+class ModelEndpoint:
+    '''
+    One model and the limits of its endpoint. api_key_env names the environment variable holding the API key.
+    '''
+
+    def __init__(self, name, base_url, api_key_env=None, requests_per_second=1.0, burst=1, max_concurrency=4,
+                 max_retries=6, timeout=60.0, max_backoff=60.0, temperature=None):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.api_key_env = api_key_env
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.temperature = temperature
+
+    def headers(self):
+        headers = {"Content-Type": "application/json"}
+        if self.api_key_env:
+            headers["Authorization"] = f"Bearer {os.environ[self.api_key_env]}"
+        return headers
+
+    def payload(self, prompt):
+        payload = {"model": self.name, "messages": [{"role": "user", "content": prompt}]}
+        if self.temperature is not None:
+            payload["temperature"] = self.temperature
+        return payload
+
+
+def load_models(path):
+    with open(path) as f:
+        return [ModelEndpoint(**settings) for settings in json.load(f)]
+
+
+class RateLimiter:
+    '''
+    Token bucket: `rate` requests per second on average, bursts of up to `burst`.
+    '''
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class RetryableError(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CacheMiss(Exception):
+    pass
+
+
+def post_json(url, payload, headers, timeout):
+    '''
+    Blocking POST of a JSON payload; returns the decoded response. Rate limiting (429), server errors (5xx),
+    timeouts and connection failures raise RetryableError.
+    '''
+    request = urllib.request.Request(url, data=json.dumps(payload).encode("utf-8"), headers=headers, method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        if e.code == 429 or e.code >= 500:
+            retry_after = e.headers.get("Retry-After")
+            try:
+                retry_after = float(retry_after) if retry_after is not None else None
+            except ValueError:
+                retry_after = None
+            raise RetryableError(f"HTTP {e.code}", retry_after) from e
+        raise
+    except (urllib.error.URLError, TimeoutError, ConnectionError) as e:
+        raise RetryableError(str(e)) from e
+
+
+def parse_answer(text):
+    '''
+    True if the model accepted the sentence as grammatical, False if it rejected it, None if the answer is neither.
+    '''
+    words = text.strip().lower().lstrip("*\"' ").split()
+    if not words:
+        return None
+    first = words[0].strip(".,!:;*\"'")
+    if first in ("yes", "grammatical", "correct"):
+        return True
+    if first in ("no", "ungrammatical", "incorrect"):
+        return False
+    return None
+
+
+def read_questions(sentences_dir=TEST_SENTENCES, tiers=TIERS):
+    '''
+    Returns [(tier, question id, sentence)] from test_sentences/{tier}_sentences.json.
+    '''
+    questions = []
+    for tier in tiers:
+        with open(os.path.join(sentences_dir, f"{tier}_sentences.json")) as f:
+            questions.extend((tier, sentence["id"], sentence["text"]) for sentence in json.load(f)["sentences"])
+    return questions
+
+
+def completed_keys(out_path):
+    '''
+    (model, tier, question, trial) of every result already in the output file.
+    '''
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by an interrupted run
+            done.add((result["model"], result["tier"], result["question"], result["trial"]))
+    return done
+
+
+class EvaluationRunner:
+    '''
+    Sends the jobs of every model through its own rate limiter and workers, appending each result to `out`.
+    With a cache, cached responses are used without a request (and, with replay_only, nothing is ever sent).
+    '''
+
+    def __init__(self, models, out, prompt=PROMPT, rng=random, cache=None, replay_only=False):
+        if replay_only and cache is None:
+            raise ValueError("replay_only needs a cache")
+        self.models = models
+        self.out = out
+        self.prompt = prompt
+        self.rng = rng
+        self.cache = cache
+        self.replay_only = replay_only
+        self.executor = ThreadPoolExecutor(max_workers=sum(model.max_concurrency for model in models))
+        self.counts = defaultdict(lambda: {"done": 0, "retries": 0, "failed": 0})
+
+    async def query(self, model, limiter, prompt, trial):
+        '''
+        Returns (answer text, attempts), retrying with exponential backoff and jitter; attempts is 0 for a cached
+        answer.
+        '''
+        payload = model.payload(prompt)
+        if self.cache is not None:
+            answer = self.cache.get(payload, trial)
+            if answer is not None:
+                return answer, 0
+            if self.replay_only:
+                raise CacheMiss("not in the response cache")
+        loop = asyncio.get_running_loop()
+        url = f"{model.base_url}/chat/completions"
+        for attempt in range(model.max_retries + 1):
+            await limiter.acquire()
+            try:
+                response = await loop.run_in_executor(self.executor, post_json, url, payload, model.headers(),
+                                                      model.timeout)
+                answer = response["choices"][0]["message"]["content"]
+                if self.cache is not None:
+                    self.cache.put(payload, trial, answer)
+                return answer, attempt + 1
+            except RetryableError as e:
+                if attempt == model.max_retries:
+                    raise
+                self.counts[model.name]["retries"] += 1
+                delay = e.retry_after
+                if delay is None:
+                    delay = min(model.max_backoff, 2 ** attempt) * (0.5 + 0.5 * self.rng.random())
+                await asyncio.sleep(delay)
+
+    async def worker(self, model, limiter, jobs):
+        while True:
+            try:
+                tier, question, sentence, trial = jobs.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            result = {"model": model.name, "tier": tier, "question": question, "trial": trial}
+            try:
+                answer, attempts = await self.query(model, limiter, self.prompt.format(sentence=sentence), trial)
+            except Exception as e:
+                # left out of the file so a rerun retries it
+                self.counts[model.name]["failed"] += 1
+                print(f"{model.name} {tier} question {question} trial {trial} failed: {type(e).__name__}: {e}")
+                continue
+            result.update(response=answer, accepted=parse_answer(answer), attempts=attempts,
+                          seconds=round(time.perf_counter() - start, 3))
+            self.out.write(json.dumps(result) + "\n")
+            self.out.flush()
+            self.counts[model.name]["done"] += 1
+
+    async def run(self, questions, trials, skip=()):
+        tasks = []
+        for model in self.models:
+            jobs = asyncio.Queue()
+            for trial in range(1, trials + 1):
+                for tier, question, sentence in questions:
+                    if (model.name, tier, question, trial) not in skip:
+                        jobs.put_nowait((tier, question, sentence, trial))
+            limiter = RateLimiter(model.requests_per_second, model.burst)
+            tasks.extend(self.worker(model, limiter, jobs) for _ in range(model.max_concurrency))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            self.executor.shutdown(wait=False)
+        return dict(self.counts)
+
+
+def run_evaluation(models, out_path, trials=100, sentences_dir=TEST_SENTENCES, tiers=TIERS, prompt=PROMPT, seed=None,
+                   cache=None, replay_only=False):
+    '''
+    Runs every model on every question `trials` times, appending to out_path and skipping the results already in it.
+    Returns the per-model counts of results written, retries and failed requests.
+    '''
+    questions = read_questions(sentences_dir, tiers)
+    skip = completed_keys(out_path)
+    start = time.perf_counter()
+    with open(out_path, "a") as out:
+        runner = EvaluationRunner(models, out, prompt, random.Random(seed), cache, replay_only)
+        counts = asyncio.run(runner.run(questions, trials, skip))
+    print(f"{sum(c['done'] for c in counts.values())} results in {time.perf_counter() - start:.1f}s "
+          f"({len(skip)} already in {out_path})")
+    for name, c in counts.items():
+        print(f"  {name}: {c['done']} written, {c['retries']} retries, {c['failed']} failed")
+    if cache is not None:
+        print(f"  response cache: {json.dumps(cache.stats())}")
+    return counts
+
+
+def summarise(out_path, summary_path=None):
+    '''
+    Per-question acceptance rates {model: {tier: {question: rate}}} of a results file (unparseable answers count as
+    not accepted); with summary_path, also written in the layout of stats_per_question.csv.
+    '''
+    accepted = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
+    with open(out_path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            accepted[result["model"]][result["tier"]][result["question"]].append(bool(result["accepted"]))
+    rates = {model: {tier: {question: round(sum(a) / len(a), 2) for question, a in sorted(questions.items())}
+                     for tier, questions in tiers.items()}
+             for model, tiers in accepted.items()}
+    if summary_path:
+        with open(summary_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow([""] + list(TIERS.values()))
+            for model, tiers in rates.items():
+                writer.writerow([model] + [str(tiers.get(tier, {})) for tier in TIERS])
+    return rates
+
+
+def write_stats(rates, stats_path):
+    '''
+    Writes the mean, standard deviation (n - 1), variance and standard error of the per-question acceptance rates of
+    each model and tier (summarise()), in the layout of stats.csv.
+    '''
+    with open(stats_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow([""] + list(AUTOMATA.values()))
+        for model, tiers in rates.items():
+            row = [model]
+            for tier in AUTOMATA:
+                values = list(tiers.get(tier, {}).values())
+                if not values:
+                    row.append("")
+                    continue
+                mean = sum(values) / len(values)
+                var = sum((v - mean) ** 2 for v in values) / (len(values) - 1) if len(values) > 1 else 0.0
+                std = math.sqrt(var)
+                row.append(str({"mean": mean, "std": std, "var": var, "ste": std / math.sqrt(len(values))}))
+            writer.writerow(row)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", help="JSON list of ModelEndpoint settings")
+    parser.add_argument("--mock", action="store_true", help="evaluate stand-in models on a local mock server")
+    parser.add_argument("--trials", type=int, default=100)
+    parser.add_argument("--tiers", nargs="+", default=list(TIERS), choices=list(TIERS))
+    parser.add_argument("--sentences", default=TEST_SENTENCES, help="directory of {tier}_sentences.json")
+    parser.add_argument("--out", default="results.jsonl")
+    parser.add_argument("--summary", help="write per-question acceptance rates to this csv")
+    parser.add_argument("--stats", help="write per-tier acceptance statistics to this csv")
+    parser.add_argument("--cache", help="SQLite response cache")
+    parser.add_argument("--cache-max-mb", type=float, help="evict least recently used responses beyond this size")
+    parser.add_argument("--replay", action="store_true", help="answer from the response cache only, with no requests")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    if args.mock:
+        from mock_server import start_mock_server
+        server = start_mock_server(failure_rate=0.05, latency=0.05, seed=args.seed or 0)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+        models = [ModelEndpoint(name, base_url, requests_per_second=200, burst=20, max_concurrency=16)
+                  for name in MOCK_MODELS]
+    elif args.models:
+        models = load_models(args.models)
+    else:
+        parser.error("give --models or --mock")
+    if args.replay and not args.cache:
+        parser.error("--replay needs --cache")
+
+    cache = None
+    if args.cache:
+        max_bytes = int(args.cache_max_mb * 2 ** 20) if args.cache_max_mb else None
+        cache = ResponseCache(args.cache, max_bytes)
+    run_evaluation(models, args.out, args.trials, args.sentences, args.tiers, seed=args.seed, cache=cache,
+                   replay_only=args.replay)
+    if args.summary or args.stats:
+        rates = summarise(args.out, args.summary)
+        if args.stats:
+            write_stats(rates, args.stats)
@@ -0,0 +1,100 @@
+'''
+Local stand-in for a chat-completions API, to run eval_runner.py offline
+
+Serves POST /v1/chat/completions (the OpenAI-compatible request and response shape eval_runner.py uses) and answers
+"yes" or "no" at random, with a per-model probability of "yes". Latency and transient failures (429 with
+Retry-After, 500, 503) can be injected to exercise the runner's rate limiting, retries and backoff.
+
+    python mock_server.py --port 8000 --failure-rate 0.05 --latency 0.2
+'''
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockModelHandler(BaseHTTPRequestHandler):
+    '''
+    Request handler; the server carries the settings (accept_rates, default_accept_rate, failure_rate, latency, rng).
+    '''
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self.send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+        try:
+            request = json.loads(body)
+            model = request["model"]
+            request["messages"][-1]["content"]
+        except (ValueError, KeyError, IndexError, TypeError):
+            self.send_json(400, {"error": {"message": "malformed request"}})
+            return
+
+        with server.lock:
+            failure = server.rng.random() < server.failure_rate
+            status = server.rng.choice([429, 500, 503])
+            answer = "yes" if server.rng.random() < server.accept_rates.get(model, server.default_accept_rate) else "no"
+            delay = server.rng.uniform(0, 2 * server.latency)
+        time.sleep(delay)
+
+        if failure:
+            headers = {"Retry-After": "0.1"} if status == 429 else {}
+            self.send_json(status, {"error": {"message": "injected failure"}}, headers)
+            return
+        self.send_json(200, {
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+        })
+
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_server(port=0, accept_rates=None, default_accept_rate=0.8, failure_rate=0.0, latency=0.0, seed=0):
+    '''
+    Starts the mock server in a daemon thread; returns the server (server.server_address[1] is the port, and
+    server.shutdown() stops it).
+    '''
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockModelHandler)
+    server.daemon_threads = True
+    server.accept_rates = accept_rates or {}
+    server.default_accept_rate = default_accept_rate
+    server.failure_rate = failure_rate
+    server.latency = latency
+    server.rng = random.Random(seed)
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--accept-rate", type=float, default=0.8, help="probability of answering yes")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="probability of a 429/500/503 response")
+    parser.add_argument("--latency", type=float, default=0.0, help="mean response delay in seconds")
+    args = parser.parse_args()
+
+    server = start_mock_server(args.port, default_accept_rate=args.accept_rate, failure_rate=args.failure_rate,
+                               latency=args.latency)
+    print(f"Mock chat-completions server on http://127.0.0.1:{server.server_address[1]}/v1")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,147 @@
+'''
+Persistent, content-addressed cache of model responses (SQLite in WAL mode)
+
+Re-running an evaluation to recompute stats.csv should not ask a model again for an answer it has already given. A
+response is stored under the SHA-256 of the request that produced it: the model, the messages, the sampling
+parameters (the whole request payload) and the trial number, since trials of one prompt are separate samples.
+
+    ResponseCache(path, max_bytes=None)
+        get(payload, trial) / put(payload, trial, response)
+        max_bytes   size limit of the stored responses; when a put takes the cache over it, the least recently used
+                    responses are evicted until it is back under 90% of the limit
+
+WAL mode lets several readers and a writer (eval_runner.py workers, other runs in other processes) use the file at
+once; each thread gets its own connection. With eval_runner.py --replay the runner answers from the cache only and
+never opens a connection to a model, which reproduces a results file, stats.csv and stats_per_question.csv offline.
+'''
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    trial INTEGER NOT NULL,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+'''
+
+
+def request_key(payload, trial):
+    '''
+    Content address of a request: SHA-256 of its canonical JSON with the trial number.
+    '''
+    canonical = json.dumps({"payload": payload, "trial": trial}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    '''
+    Responses keyed by request_key, in an SQLite file shared by threads and processes.
+    '''
+
+    def __init__(self, path, max_bytes=None, timeout=30.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        connection = self.connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+        self.size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    def get(self, payload, trial):
+        '''
+        The cached response text of a request, or None.
+        '''
+        key = request_key(payload, trial)
+        connection = self.connection()
+        row = connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        with self.lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, payload, trial, response):
+        key = request_key(payload, trial)
+        size = len(response.encode("utf-8")) + len(key)
+        now = time.time()
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            # a response stored again for the same key replaces the old row, so only the difference is added
+            old = connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, model, trial, response, size, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", (key, payload.get("model", ""), trial, response, size, now, now))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        with self.lock:
+            self.size += size - (old[0] if old is not None else 0)
+            over = self.max_bytes is not None and self.size > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self):
+        '''
+        Deletes least recently used responses until the cache is under 90% of max_bytes.
+        '''
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            # other processes write to the same file, so recount rather than trust the running total
+            size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            target = 0.9 * self.max_bytes
+            keys = []
+            for key, row_size in connection.execute("SELECT key, size FROM responses ORDER BY last_used"):
+                if size <= target:
+                    break
+                keys.append((key,))
+                size -= row_size
+            connection.executemany("DELETE FROM responses WHERE key = ?", keys)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        with self.lock:
+            self.size = size
+            self.evicted += len(keys)
+
+    def __len__(self):
+        return self.connection().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def stats(self):
+        return {"responses": len(self), "bytes": self.size, "hits": self.hits, "misses": self.misses,
+                "evicted": self.evicted}
+
+    def close(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
@@ -0,0 +1,191 @@
+'''
+Long-format, columnar store of the evaluation statistics
+
+stats.csv and stats_per_question.csv keep a Python dict repr in every cell ("{'mean': np.float64(0.9968), ...}",
+"{1: 1.0, 2: 1.0, ...}"), so loading them takes eval, NumPy, and a reparse of every cell on every load. A StatsTable
+keeps the same numbers as one row per value:
+
+    model   tier   question   metric       value
+    o1      cf     1          acceptance   1.0        (stats_per_question.csv)
+    o1      cf     -1         mean         0.9968     (stats.csv; question -1 = the whole tier)
+
+as NumPy columns (model, tier and metric as int codes into the `models`, `tiers` and `metrics` name arrays), saved
+to a single .npz without pickled objects. Loading is a few array reads, and aggregating across models and tiers is
+array arithmetic:
+
+    table = load_stats("stats.npz")
+    rates = table.matrix("acceptance")              # [model, tier, question], NaN where missing
+    np.nanmean(rates, axis=2)                       # mean acceptance per model and tier
+    table.select(tier="cs", metric="mean").value
+
+The converter parses the cells with regular expressions, not eval:
+
+    python stats_store.py stats.csv stats_per_question.csv --out stats.npz
+
+Needs NumPy.
+'''
+
+import argparse
+import csv
+import re
+
+import numpy as np
+
+
+TIERS = ["cf", "ix", "cs"]
+TIER_COLUMNS = {"Context-Free": "cf", "Mildly Context-Sensitive": "ix", "Context-Sensitive": "cs",
+                "PDA": "cf", "HOPDA": "ix", "LBA": "cs"}
+TIER_METRICS = ["mean", "std", "var", "ste"]
+QUESTION_METRIC = "acceptance"
+WHOLE_TIER = -1
+
+NUMBER = r"[-+]?(?:\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?|nan|inf)"
+METRIC_ITEM = re.compile(r"'(\w+)':\s*(?:np\.float64\()?(" + NUMBER + r")\)?")
+QUESTION_ITEM = re.compile(r"(\d+):\s*(?:np\.float64\()?(" + NUMBER + r")\)?")
+
+
+class StatsTable:
+    '''
+    Columns model, tier, question, metric (int arrays) and value (float64), with the name arrays of the codes.
+    '''
+
+    def __init__(self, models, tiers, metrics, model, tier, question, metric, value):
+        self.models = np.asarray(models, dtype=str)
+        self.tiers = np.asarray(tiers, dtype=str)
+        self.metrics = np.asarray(metrics, dtype=str)
+        self.model = np.asarray(model, dtype=np.int16)
+        self.tier = np.asarray(tier, dtype=np.int8)
+        self.question = np.asarray(question, dtype=np.int16)
+        self.metric = np.asarray(metric, dtype=np.int8)
+        self.value = np.asarray(value, dtype=np.float64)
+
+    @classmethod
+    def from_records(cls, records):
+        '''
+        Builds a table from (model, tier, question, metric, value) rows; names are coded in order of appearance
+        (tiers always in the order cf, ix, cs).
+        '''
+        models, metrics = {}, {}
+        columns = ([], [], [], [], [])
+        for model, tier, question, metric, value in records:
+            columns[0].append(models.setdefault(model, len(models)))
+            columns[1].append(TIERS.index(tier))
+            columns[2].append(question)
+            columns[3].append(metrics.setdefault(metric, len(metrics)))
+            columns[4].append(value)
+        return cls(list(models), TIERS, list(metrics), *columns)
+
+    def __len__(self):
+        return len(self.value)
+
+    def code(self, names, name):
+        matches = np.flatnonzero(names == name)
+        if not matches.size:
+            raise KeyError(name)
+        return matches[0]
+
+    def mask(self, model=None, tier=None, question=None, metric=None):
+        mask = np.ones(len(self), dtype=bool)
+        if model is not None:
+            mask &= self.model == self.code(self.models, model)
+        if tier is not None:
+            mask &= self.tier == self.code(self.tiers, tier)
+        if question is not None:
+            mask &= self.question == question
+        if metric is not None:
+            mask &= self.metric == self.code(self.metrics, metric)
+        return mask
+
+    def select(self, model=None, tier=None, question=None, metric=None):
+        '''
+        The rows matching every given name (codes and name arrays unchanged).
+        '''
+        keep = self.mask(model, tier, question, metric)
+        return StatsTable(self.models, self.tiers, self.metrics, self.model[keep], self.tier[keep],
+                          self.question[keep], self.metric[keep], self.value[keep])
+
+    def matrix(self, metric=QUESTION_METRIC):
+        '''
+        The values of one metric as a [model, tier, question] array (NaN where missing); for a whole-tier metric
+        the question axis has length 1.
+        '''
+        rows = self.mask(metric=metric)
+        questions = self.question[rows]
+        whole_tier = questions.size and questions.max() == WHOLE_TIER
+        result = np.full((len(self.models), len(self.tiers), 1 if whole_tier else int(questions.max(initial=0))), np.nan)
+        result[self.model[rows], self.tier[rows], 0 if whole_tier else questions - 1] = self.value[rows]
+        return result
+
+    def records(self):
+        for row in zip(self.models[self.model], self.tiers[self.tier], self.question.tolist(),
+                       self.metrics[self.metric], self.value.tolist()):
+            yield (str(row[0]), str(row[1]), row[2], str(row[3]), row[4])
+
+    def save(self, path):
+        np.savez_compressed(path, models=self.models, tiers=self.tiers, metrics=self.metrics, model=self.model,
+                            tier=self.tier, question=self.question, metric=self.metric, value=self.value)
+
+
+def load_stats(path):
+    with np.load(path, allow_pickle=False) as data:
+        return StatsTable(data["models"], data["tiers"], data["metrics"], data["model"], data["tier"],
+                          data["question"], data["metric"], data["value"])
+
+
+def read_stats_csv(path):
+    '''
+    (model, tier, -1, metric, value) rows of a stats.csv-style file.
+    '''
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        tiers = [TIER_COLUMNS[column] for column in next(reader)[1:]]
+        for row in reader:
+            for tier, cell in zip(tiers, row[1:]):
+                for metric, value in METRIC_ITEM.findall(cell):
+                    yield row[0], tier, WHOLE_TIER, metric, float(value)
+
+
+def read_per_question_csv(path):
+    '''
+    (model, tier, question, "acceptance", value) rows of a stats_per_question.csv-style file.
+    '''
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        tiers = [TIER_COLUMNS[column] for column in next(reader)[1:]]
+        for row in reader:
+            for tier, cell in zip(tiers, row[1:]):
+                for question, value in QUESTION_ITEM.findall(cell):
+                    yield row[0], tier, int(question), QUESTION_METRIC, float(value)
+
+
+def from_rates(rates):
+    '''
+    (model, tier, question, "acceptance", value) rows of per-question acceptance rates {model: {tier: {question:
+    rate}}}, as returned by eval_runner.summarise().
+    '''
+    for model, tiers in rates.items():
+        for tier, questions in tiers.items():
+            for question, rate in questions.items():
+                yield model, tier, int(question), QUESTION_METRIC, float(rate)
+
+
+def convert(stats_path=None, per_question_path=None, out_path="stats.npz"):
+    records = []
+    if per_question_path:
+        records.extend(read_per_question_csv(per_question_path))
+    if stats_path:
+        records.extend(read_stats_csv(stats_path))
+    table = StatsTable.from_records(records)
+    table.save(out_path)
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("stats", nargs="?", default="stats.csv")
+    parser.add_argument("per_question", nargs="?", default="stats_per_question.csv")
+    parser.add_argument("--out", default="stats.npz")
+    args = parser.parse_args()
+
+    table = convert(args.stats, args.per_question, args.out)
+    print(f"{len(table)} values of {len(table.models)} models and {len(table.metrics)} metrics -> {args.out}")
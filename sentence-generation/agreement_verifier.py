@@ -0,0 +1,110 @@
+'''
+Linear-time verifier of the cross-serial number agreement of the context-sensitive tier (cs_rules)
+
+The context-sensitive production of cs_rules
+
+    ("NP_sequence", "VP_placeholder") -> NP_sg NP_sequence VP_sg VP_sequence | NP_pl NP_sequence VP_pl VP_sequence
+
+ties the number of the first noun phrase to the number of the first verb phrase across the whole NP_sequence in
+between (NP_sequence and VP_sequence themselves are free). Checking that with a general parser is wasteful; the
+dependency only needs one left-to-right pass over the tokens, tagged through the inverse lexicon:
+
+    - the head of a noun phrase is its first noun (NP -> Det (Adj) N ... | ProperNoun ...), so the first noun of the
+      sentence gives the number of the first NP, which is queued
+    - inside the NP_sequence verbs only occur in relative clauses, right after the relative pronoun (RC -> RelPronoun
+      VP, VP -> (Adv) V ...), so the first verb not preceded by "RelPronoun (Adv)" is the head of the first VP; it
+      dequeues the pending number and must agree with it
+
+Each token is looked at once with O(1) state (the pending number and the last two tags), so bulk validation runs
+in O(n) per sentence.
+
+    python agreement_verifier.py [corpus files]   # defaults to the CS sentence list and test set
+'''
+
+import sys
+import time
+
+from recognizer import read_corpus, tokenize
+
+
+NUMBER = {"N_sg": "sg", "ProperNoun_sg": "sg", "N_pl": "pl", "V_sg": "sg", "V_pl": "pl"}
+NOUNS = ("N_sg", "N_pl", "ProperNoun_sg")
+VERBS = ("V_sg", "V_pl")
+
+
+class AgreementVerifier:
+    '''
+    Checks the NP/VP number dependency of cs_rules on tokenised sentences, with a word -> category map from the lexicon.
+    '''
+
+    def __init__(self, lexicon):
+        self.categories = {}
+        for category, words in lexicon.items():
+            for word in words:
+                # "the" is both Det_sg and Det_pl; determiners carry no number the verifier needs
+                self.categories.setdefault(word, category)
+
+    def tag(self, word, first=False):
+        category = self.categories.get(word)
+        if category is None and first:
+            # the first word was capitalised by format_sentence
+            category = self.categories.get(word[:1].lower() + word[1:])
+        return category
+
+    def violation(self, words):
+        '''
+        None if the sentence satisfies the dependency, otherwise the reason it does not.
+        '''
+        pending = None  # number of the first NP, waiting for the first VP
+        previous = before_previous = None
+        for i, word in enumerate(words):
+            category = self.tag(word, first=(i == 0))
+            if category is None:
+                return f"unknown word '{word}'"
+            if category in NOUNS and pending is None:
+                pending = NUMBER[category]
+            elif category in VERBS:
+                embedded = previous == "RelPronoun" or (previous == "Adv" and before_previous == "RelPronoun")
+                if not embedded:
+                    if pending is None:
+                        return "verb phrase before any noun phrase"
+                    if NUMBER[category] != pending:
+                        return f"{pending} noun phrase with {NUMBER[category]} verb '{word}'"
+                    return None
+            before_previous, previous = previous, category
+        if pending is None:
+            return "no noun phrase"
+        return "no verb phrase"
+
+    def validate(self, sentences):
+        '''
+        Returns (index, reason) for every sentence (string) that violates the dependency.
+        '''
+        violations = []
+        for k, sentence_str in enumerate(sentences):
+            reason = self.violation(tokenize(sentence_str))
+            if reason is not None:
+                violations.append((k, reason))
+        return violations
+
+
+def verify_files(verifier, paths):
+    '''
+    Verifies every corpus file in bulk and prints the violating sentences and the throughput.
+    '''
+    for path in paths:
+        sentences = read_corpus(path)
+        start = time.time()
+        violations = verifier.validate(sentences)
+        elapsed = time.time() - start
+        for k, reason in violations:
+            print(f"{path}:{k + 1}: {reason}: {sentences[k]}")
+        print(f"{path}: {len(sentences) - len(violations)} of {len(sentences)} sentences agree "
+              f"({len(sentences) / max(elapsed, 1e-9):.0f} sentences/s)")
+
+
+if __name__ == "__main__":
+    from main import lexicon
+
+    paths = sys.argv[1:] or ["sentence_lists/cs_sentences.txt", "test_sentences/cs_sentences.json"]
+    verify_files(AgreementVerifier(lexicon), paths)
@@ -0,0 +1,246 @@
+'''
+Benchmarks of the generators and of the export loop
+
+Measures, for generate_sentence_fsm, generate_sentence, generate_sentence_noncf, generate_sentence_recursion_limits
+and main_export_lists:
+
+    sentences_per_s     generated sentences per second
+    accepted_per_s      sentences per second that fall in the export's length window (min_length..max_length)
+    p50_us / p99_us     per-sentence latency percentiles, in microseconds
+    peak_memory_kb      peak Python allocation (tracemalloc), measured in a separate run so it does not slow the timing
+
+The budgeted generators are swept over max_expansion_per_symbol and max_recursion_depth. Every run draws from a
+fixed seed, so two commits generate the same sentences. Throughputs are per second of CPU time of this process
+(time.process_time), so other processes on the machine do not count against them. The whole set of benchmarks is run
+--repeats times in rounds and each one reports its median run, with the CPU time of every run kept in the record.
+Results are written as JSON, one record per (benchmark, parameters), with the commit they were measured on; --compare
+prints the change against an earlier results file and flags throughput regressions beyond --tolerance. Two runs of
+the same code still differ: on a shared single-core machine the medians of 5 rounds were mostly within 15% of each
+other and occasionally 30-40% apart (the fastest runs were worse, a few runs being much faster than the rest). The
+default tolerance is therefore 25%; use more --sentences and --repeats, and rerun a flagged benchmark, before reading
+a smaller change as a regression.
+
+    python benchmark.py --sentences 2000 --out bench_new.json --compare bench_old.json
+'''
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from generate_sentences import generate_sentence_fsm, generate_sentence, generate_sentence_noncf, generate_sentence_recursion_limits
+import main
+from main import fms_rules, lexicon, cf_grammar, ix_grammar, cs_grammar
+
+
+EXPANSION_SWEEP = (5, 10, 20)
+DEPTH_SWEEP = (4, 10, 100000)
+
+budgeted_generators = {
+    "generate_sentence": (generate_sentence, cf_grammar),
+    "generate_sentence_noncf": (generate_sentence_noncf, ix_grammar),
+    "generate_sentence_recursion_limits": (generate_sentence_recursion_limits, cs_grammar),
+}
+
+
+def measure_peak_memory(run):
+    tracemalloc.start()
+    try:
+        run()
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def bench_generator(name, params, generate, sentences, min_length, max_length, memory_sentences=200):
+    '''
+    Returns run(): every call times `sentences` calls of generate(rng) from the same seed and returns the record of
+    the benchmark so far (throughput of the median call, latencies of all of them).
+    '''
+    latencies, times = [], []
+
+    def memory_run():
+        rng = random.Random(0)
+        for _ in range(min(sentences, memory_sentences)):
+            try:
+                generate(rng)
+            except Exception:
+                pass
+
+    record = {"benchmark": name, "params": params, "sentences": sentences, "peak_memory_kb": measure_peak_memory(memory_run)}
+
+    def run():
+        rng = random.Random(0)
+        accepted, errors = 0, 0
+        start = time.process_time()
+        for _ in range(sentences):
+            t0 = time.perf_counter()
+            try:
+                sentence = generate(rng)
+            except Exception:
+                sentence = None
+                errors += 1
+            latencies.append(time.perf_counter() - t0)
+            if sentence is not None and min_length <= len(sentence) <= max_length:
+                accepted += 1
+        times.append(time.process_time() - start)
+        elapsed = statistics.median(times)
+        percentiles = statistics.quantiles(latencies, n=100)
+        record.update({
+            "seconds": elapsed,
+            "repeat_seconds": times,
+            "sentences_per_s": sentences / elapsed,
+            "accepted_per_s": accepted / elapsed,
+            "p50_us": percentiles[49] * 1e6,
+            "p99_us": percentiles[98] * 1e6,
+            "errors": errors,
+        })
+        return record
+
+    return run
+
+
+def bench_export(sentences, exact_length, min_length, max_length):
+    '''
+    Returns run(): every call times main_export_lists(sentences) in a temporary directory (its per-sentence printing
+    goes to devnull) from the same seed and returns the record so far (the median call). sentences_per_s counts every
+    attempt of the export (its generation counters), accepted_per_s the sentences written, so the cost of the
+    rejection loop shows as the gap between the two.
+    '''
+    def export():
+        random.seed(0)
+        with tempfile.TemporaryDirectory() as directory:
+            cwd = os.getcwd()
+            os.chdir(directory)
+            os.mkdir("sentence_lists")
+            try:
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    return main.main_export_lists(sentences, min_length=min_length, max_length=max_length, exact_length=exact_length)
+            finally:
+                os.chdir(cwd)
+
+    times = []
+    record = {"benchmark": "main_export_lists", "params": {"exact_length": exact_length}, "p50_us": None,
+              "p99_us": None, "peak_memory_kb": measure_peak_memory(export)}
+
+    def run():
+        start = time.process_time()
+        counters = export()
+        times.append(time.process_time() - start)
+        elapsed = statistics.median(times)
+        written = sum(tier["accepted"] for tier in counters.values())
+        attempts = sum(tier["attempts"] for tier in counters.values())
+        record.update({
+            "sentences": attempts,
+            "seconds": elapsed,
+            "repeat_seconds": times,
+            "sentences_per_s": attempts / elapsed,
+            "accepted_per_s": written / elapsed,
+            "errors": sum(sum(tier["exceptions"].values()) for tier in counters.values()),
+        })
+        return record
+
+    return run
+
+
+def run_benchmarks(sentences, export_sentences, repeats=5, min_length=11, max_length=20):
+    '''
+    Runs every benchmark `repeats` times, in rounds over all of them, so that a slow spell of the machine hits one
+    round of every benchmark rather than all the repeats of one.
+    '''
+    runs = [bench_generator("generate_sentence_fsm", {}, lambda rng: generate_sentence_fsm(fms_rules, lexicon, rng=rng),
+                            sentences, min_length, max_length)]
+    for name, (generator, grammar) in budgeted_generators.items():
+        for max_expansion in EXPANSION_SWEEP:
+            for max_depth in DEPTH_SWEEP:
+                params = {"max_expansion_per_symbol": max_expansion, "max_recursion_depth": max_depth}
+
+                def generate(rng, generator=generator, grammar=grammar, max_expansion=max_expansion, max_depth=max_depth):
+                    return generator(grammar, lexicon, max_expansion_per_symbol=max_expansion,
+                                     max_recursion_depth=max_depth, print_out=False, rng=rng)
+
+                runs.append(bench_generator(name, params, generate, sentences, min_length, max_length))
+    for exact_length in (True, False):
+        runs.append(bench_export(export_sentences, exact_length, min_length, max_length))
+    for repeat in range(repeats):
+        results = [run() for run in runs]
+        print(f"Round {repeat + 1} of {repeats} done")
+        sys.stdout.flush()
+    for result in results:
+        print_result(result)
+    return results
+
+
+def result_key(result):
+    return result["benchmark"] + " " + json.dumps(result["params"], sort_keys=True)
+
+
+def print_result(result):
+    latency = f"p50 {result['p50_us']:.0f}us p99 {result['p99_us']:.0f}us " if result["p50_us"] is not None else ""
+    print(f"{result_key(result)}: {result['sentences_per_s']:.0f} sentences/s, {result['accepted_per_s']:.0f} accepted/s, "
+          f"{latency}peak {result['peak_memory_kb']:.0f} KiB")
+    sys.stdout.flush()
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new, tolerance=0.25):
+    '''
+    Prints the throughput ratios new/old (generated and accepted sentences per second, each of the median run) of
+    every benchmark present in both result files; returns the regressions (either slower by more than `tolerance`).
+    '''
+    old_results = {result_key(result): result for result in old["results"]}
+    regressions = []
+    for result in new["results"]:
+        key = result_key(result)
+        if key not in old_results:
+            continue
+        ratio = result["sentences_per_s"] / old_results[key]["sentences_per_s"]
+        old_accepted = old_results[key]["accepted_per_s"]
+        accepted_ratio = result["accepted_per_s"] / old_accepted if old_accepted else 1.0
+        flag = ""
+        if min(ratio, accepted_ratio) < 1 - tolerance:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        print(f"{key}: {ratio:.2f}x generated, {accepted_ratio:.2f}x accepted{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sentences", type=int, default=2000, help="sentences per generator benchmark")
+    parser.add_argument("--export-sentences", type=int, default=250, help="sentences per tier for main_export_lists")
+    parser.add_argument("--repeats", type=int, default=5, help="runs of every benchmark; the median is reported")
+    parser.add_argument("--out", default="benchmark_results.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="throughput drop reported as a regression")
+    args = parser.parse_args()
+
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": run_benchmarks(args.sentences, args.export_sentences, args.repeats),
+    }
+    with open(args.out, "w") as file:
+        json.dump(results, file, indent=1)
+    print(f"Results written to {args.out}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(json.load(file), results, args.tolerance)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,195 @@
+'''
+Compiled (integer-interned) form of the rule dicts and lexicon in main.py
+
+The generators in generate_sentences.py used to work directly on the dicts of string lists, which means a
+string membership check (`sym in rules`, `sym in lexicon.keys()`) and an `isinstance` normalisation of the
+chosen expansion at every step. A CompiledGrammar is built once per grammar and holds:
+
+    names / ids             every symbol interned to a small int (nonterminals first, then preterminals, then terminals)
+    kind                    bitmask per symbol: TERMINAL, PRETERMINAL (a lexicon key) or NONTERMINAL (a rules key)
+    prod_offsets            productions of symbol s are p in range(prod_offsets[s], prod_offsets[s + 1])
+    rhs_offsets / rhs       right-hand side of production p is rhs[rhs_offsets[p]:rhs_offsets[p + 1]]
+    prod_lhs                left-hand side symbol of production p
+    word_offsets / words    words of preterminal s are vocab[w] for w in words[word_offsets[s]:word_offsets[s + 1]]
+                            (a terminal has itself as its only word)
+    min_depth               smallest derivation-tree depth at which s reaches (pre)terminals (0 for those themselves)
+    forced_offsets /        productions of s that achieve min_depth[s], used to force terminal expansion when the
+    forced_prods            expansion budgets run out
+    counters                GenerationCounters of the sentences generated from this grammar (see generation_counters.py)
+
+Context-sensitive left-hand sides (the tuple key ("NP_sequence", "VP_placeholder") in cs_rules) are interned as
+a single nonterminal whose name is the tuple; `contexts` maps the tuple of member ids to that symbol, and
+resolved_expansion(p) gives the right-hand side of p with such a tuple rewritten to its symbol.
+'''
+
+import random
+from array import array
+
+from generation_counters import GenerationCounters
+
+
+TERMINAL = 1
+PRETERMINAL = 2
+NONTERMINAL = 4
+
+INFINITE_DEPTH = float("inf")
+
+
+class CompiledGrammar:
+    '''
+    Flat, int-indexed view of a (rules, lexicon) pair, built once and shared by every generated sentence.
+    '''
+
+    def __init__(self, rules, lexicon, start="S"):
+        self.rules = rules
+        self.lexicon = lexicon
+
+        self.names = []
+        self.ids = {}
+        self.kind = bytearray()
+
+        for lhs in rules:
+            self._intern(lhs, NONTERMINAL)
+        for category in lexicon:
+            self._intern(category, PRETERMINAL)
+
+        # productions, normalised once (str -> [str], None -> [], tuple -> list) instead of at every expansion
+        expansions_per_symbol = []
+        for lhs in rules:
+            expansions = []
+            for expansion in rules[lhs]:
+                if isinstance(expansion, str):
+                    expansion = [expansion]
+                elif expansion is None:
+                    expansion = []
+                expansions.append([self._intern(sym, TERMINAL) for sym in expansion])
+            expansions_per_symbol.append(expansions)
+
+        self.contexts = {}
+        for lhs in rules:
+            if isinstance(lhs, tuple):
+                self.contexts[tuple(self._intern(sym, TERMINAL) for sym in lhs)] = self.ids[lhs]
+
+        # vocabulary of the lexicon (closed class of words per preterminal), then the terminals written in the rules
+        self.vocab = []
+        self.vocab_ids = {}
+        words = [word for category in lexicon for word in lexicon[category]]
+        words += [name for sym, name in enumerate(self.names) if self.kind[sym] & TERMINAL]
+        for word in words:
+            if word not in self.vocab_ids:
+                self.vocab_ids[word] = len(self.vocab)
+                self.vocab.append(word)
+
+        n = len(self.names)
+        self.prod_offsets = array("i", [0])
+        self.rhs_offsets = array("i", [0])
+        self.rhs = array("i")
+        self.prod_lhs = array("i")
+        self.word_offsets = array("i", [0])
+        self.words = array("i")
+        for sym in range(n):
+            if sym < len(expansions_per_symbol):
+                for expansion in expansions_per_symbol[sym]:
+                    self.rhs.extend(expansion)
+                    self.rhs_offsets.append(len(self.rhs))
+                    self.prod_lhs.append(sym)
+            self.prod_offsets.append(len(self.prod_lhs))
+
+            if self.kind[sym] & PRETERMINAL:
+                self.words.extend(self.vocab_ids[word] for word in lexicon[self.names[sym]])
+            elif self.kind[sym] & TERMINAL:
+                self.words.append(self.vocab_ids[self.names[sym]])
+            self.word_offsets.append(len(self.words))
+
+        # shortest-terminal table, a min-depth fixpoint over the productions (replaces hand-coded forced expansions)
+        self.min_depth = [INFINITE_DEPTH if self.kind[sym] & NONTERMINAL else 0 for sym in range(n)]
+        changed = True
+        while changed:
+            changed = False
+            for prod, lhs in enumerate(self.prod_lhs):
+                depth = self._production_depth(prod)
+                if depth < self.min_depth[lhs]:
+                    self.min_depth[lhs] = depth
+                    changed = True
+
+        self.forced_offsets = array("i", [0])
+        self.forced_prods = array("i")
+        for sym in range(n):
+            for prod in self.productions(sym):
+                if self.min_depth[sym] < INFINITE_DEPTH and self._production_depth(prod) == self.min_depth[sym]:
+                    self.forced_prods.append(prod)
+            self.forced_offsets.append(len(self.forced_prods))
+
+        self.start = self.ids[start]
+        self.counters = GenerationCounters()
+
+    def _production_depth(self, prod):
+        return 1 + max((self.min_depth[sym] for sym in self.expansion(prod)), default=0)
+
+    def _intern(self, name, kind):
+        if name in self.ids:
+            return self.ids[name]
+        self.ids[name] = len(self.names)
+        self.names.append(name)
+        self.kind.append(kind)
+        return self.ids[name]
+
+    def __len__(self):
+        return len(self.names)
+
+    def is_nonterminal(self, sym):
+        return self.kind[sym] & NONTERMINAL
+
+    def is_preterminal(self, sym):
+        return self.kind[sym] & PRETERMINAL
+
+    def productions(self, sym):
+        return range(self.prod_offsets[sym], self.prod_offsets[sym + 1])
+
+    def expansion(self, prod):
+        return self.rhs[self.rhs_offsets[prod]:self.rhs_offsets[prod + 1]]
+
+    def resolved_expansion(self, prod):
+        '''
+        Right-hand side of production p as a tuple, rewritten to the context symbol if the whole right-hand side is a
+        context-sensitive left-hand side (S -> NP_sequence VP_placeholder in cs_rules), as
+        generate_sentence_recursion_limits does.
+        '''
+        rhs = tuple(self.expansion(prod))
+        if rhs in self.contexts:
+            return (self.contexts[rhs],)
+        return rhs
+
+    def choose(self, sym, rng=random):
+        '''
+        Picks one of the productions of `sym` uniformly (as random.choice(rules[sym]) did) and returns its index.
+        '''
+        return rng.randrange(self.prod_offsets[sym], self.prod_offsets[sym + 1])
+
+    def forced_choice(self, sym, rng=random):
+        '''
+        Picks one of the shortest-terminal productions of `sym` uniformly and returns its index.
+        '''
+        start, end = self.forced_offsets[sym], self.forced_offsets[sym + 1]
+        if start == end:
+            raise ValueError(f"{self.names[sym]} derives no terminal string")
+        return self.forced_prods[rng.randrange(start, end)]
+
+    def encode(self, symbols):
+        return [self.ids[sym] for sym in symbols]
+
+    def decode(self, symbols):
+        return [self.names[sym] for sym in symbols]
+
+    def lexicalise(self, symbols, rng=random):
+        '''
+        Replaces every preterminal by a random word of its lexicon category; other symbols are kept by name.
+        '''
+        sentence = []
+        for sym in symbols:
+            if self.kind[sym] & PRETERMINAL:
+                start = self.word_offsets[sym]
+                sentence.append(self.vocab[self.words[rng.randrange(start, self.word_offsets[sym + 1])]])
+            else:
+                sentence.append(self.names[sym])
+        return sentence
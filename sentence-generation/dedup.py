@@ -0,0 +1,93 @@
+'''
+Deduplication of generated corpora
+
+Short CF/FSM sentences repeat often when millions are drawn, and every repeat costs evaluation time without adding
+signal. The exports can pass each sentence through a deduplicator, which keeps only the first occurrence:
+
+    ExactDeduplicator   a set of 128-bit BLAKE2 digests of the sentences (exact up to digest collisions, about 90
+                        bytes per distinct sentence); for runs of up to 1M sentences
+    BloomDeduplicator   a Bloom filter of fixed size for an expected number of sentences and a target false-positive
+                        rate (a new sentence is wrongly reported as a duplicate with about that probability; 2.4 MB
+                        per 1M sentences at 1e-4); for runs of more than 1M sentences
+
+make_deduplicator picks one from the expected number of sentences (exact_limit, 1M by default, is where the set would
+pass about 90 MB).
+'''
+
+import hashlib
+import math
+
+
+def sentence_digest(sentence_str):
+    return hashlib.blake2b(sentence_str.encode("utf-8"), digest_size=16).digest()
+
+
+class ExactDeduplicator:
+    '''
+    Remembers the digest of every sentence seen.
+    '''
+
+    def __init__(self):
+        self.digests = set()
+        self.seen = 0
+        self.duplicates = 0
+
+    def add(self, sentence_str):
+        '''
+        Records the sentence; returns True the first time it is seen and False for a duplicate.
+        '''
+        self.seen += 1
+        digest = sentence_digest(sentence_str)
+        if digest in self.digests:
+            self.duplicates += 1
+            return False
+        self.digests.add(digest)
+        return True
+
+    @property
+    def duplicate_rate(self):
+        return self.duplicates / max(self.seen, 1)
+
+
+class BloomDeduplicator(ExactDeduplicator):
+    '''
+    Bloom filter sized for `capacity` sentences at `false_positive_rate`; memory is fixed at construction.
+    '''
+
+    def __init__(self, capacity, false_positive_rate=1e-4):
+        super().__init__()
+        self.digests = None
+        self.num_bits = max(8, math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def add(self, sentence_str):
+        self.seen += 1
+        digest = sentence_digest(sentence_str)
+        # k bit positions by double hashing on the two halves of the digest
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        bits = self.bits
+        new = False
+        for i in range(self.num_hashes):
+            bit = (h1 + i * h2) % self.num_bits
+            byte, mask = bit >> 3, 1 << (bit & 7)
+            if not bits[byte] & mask:
+                bits[byte] |= mask
+                new = True
+        if not new:
+            self.duplicates += 1
+        return new
+
+
+def make_deduplicator(expected_sentences, false_positive_rate=1e-4, exact_limit=1_000_000):
+    '''
+    Exact set up to exact_limit expected sentences, fixed-memory Bloom filter above.
+    '''
+    if expected_sentences <= exact_limit:
+        return ExactDeduplicator()
+    return BloomDeduplicator(expected_sentences, false_positive_rate)
+
+
+def report_duplicate_rate(tier, deduplicator):
+    print(f"{tier}: {deduplicator.duplicates} duplicates out of {deduplicator.seen} sentences (duplicate rate {100 * deduplicator.duplicate_rate:.2f}%)")
@@ -0,0 +1,203 @@
+'''
+Structured derivation tracing
+
+print_out=True prints every step of a derivation, which is fine for one example sentence but not for keeping the
+derivations of a whole corpus. The generators (and LengthSampler) instead accept a `tracer`, called at every step of
+the derivation:
+
+    node(parent, sym)        a symbol instance enters the derivation under node `parent` (-1 for the root); returns
+                             its node index
+    expand(node, sym, prod)  the node is rewritten with production `prod`
+    force(node, sym, reason) the node's expansion budget ran out ("expansion count" or "recursion depth") and it is
+                             forced to terminals with the shortest-terminal productions
+
+TreeTracer records each derivation as a DerivationTree: four parallel arrays with one entry per node (parent index,
+symbol id, production id or -1 for a (pre)terminal, forced flag). Parents always come before their children.
+PrintTracer prints the steps as print_out did. Without a tracer the generators run their untraced loops, so tracing
+costs nothing when it is off.
+
+TreeWriter / TreeReader store trees in bulk in a binary file next to the sentences: a JSON header line with the
+symbol names of the grammar, then per tree its node count followed by the four arrays (native int32 / bytes).
+'''
+
+import json
+import sys
+from array import array
+
+
+class Tracer:
+    '''
+    Tracer interface; records nothing.
+    '''
+
+    def begin(self):
+        '''
+        Called before each sentence is derived.
+        '''
+
+    def node(self, parent, sym):
+        return -1
+
+    def expand(self, node, sym, prod):
+        pass
+
+    def force(self, node, sym, reason):
+        pass
+
+
+class DerivationTree:
+    '''
+    Array-backed derivation tree.
+    '''
+
+    def __init__(self, parent=None, symbol=None, production=None, forced=None):
+        self.parent = parent if parent is not None else array("i")
+        self.symbol = symbol if symbol is not None else array("i")
+        self.production = production if production is not None else array("i")
+        self.forced = forced if forced is not None else bytearray()
+
+    def __len__(self):
+        return len(self.parent)
+
+    def depths(self):
+        depths = [0] * len(self)
+        for node, parent in enumerate(self.parent):
+            if parent >= 0:
+                depths[node] = depths[parent] + 1
+        return depths
+
+    def depth(self):
+        return max(self.depths(), default=0)
+
+    def leaves(self):
+        '''
+        Symbol ids of the (pre)terminal leaves, left to right.
+        '''
+        return [sym for sym, prod in zip(self.symbol, self.production) if prod < 0]
+
+    def any_forced(self):
+        return any(self.forced)
+
+    def format(self, names):
+        '''
+        Bracketed form, e.g. (S (NP_sg Det_sg N_sg) (VP_sg V_sg)), with `names` indexed by symbol id.
+        '''
+        children = [[] for _ in range(len(self))]
+        roots = []
+        for node, parent in enumerate(self.parent):
+            (children[parent] if parent >= 0 else roots).append(node)
+
+        def format_node(node):
+            name = names[self.symbol[node]]
+            if isinstance(name, (tuple, list)):
+                name = "+".join(name)
+            if self.production[node] < 0:
+                return name
+            return "(" + " ".join([name] + [format_node(child) for child in children[node]]) + ")"
+
+        return " ".join(format_node(root) for root in roots)
+
+
+class TreeTracer(Tracer):
+    '''
+    Records the derivation of the current sentence in `tree` (a new DerivationTree at every begin()).
+    '''
+
+    def __init__(self):
+        self.tree = DerivationTree()
+
+    def begin(self):
+        self.tree = DerivationTree()
+
+    def node(self, parent, sym):
+        tree = self.tree
+        tree.parent.append(parent)
+        tree.symbol.append(sym)
+        tree.production.append(-1)
+        tree.forced.append(tree.forced[parent] if parent >= 0 else 0)
+        return len(tree.parent) - 1
+
+    def expand(self, node, sym, prod):
+        self.tree.production[node] = prod
+
+    def force(self, node, sym, reason):
+        self.tree.forced[node] = 1
+
+
+class PrintTracer(Tracer):
+    '''
+    Prints every step (the print_out output), and passes it on to an optional inner tracer.
+    '''
+
+    def __init__(self, grammar, inner=None):
+        self.grammar = grammar
+        self.inner = inner
+
+    def begin(self):
+        if self.inner is not None:
+            self.inner.begin()
+
+    def node(self, parent, sym):
+        return self.inner.node(parent, sym) if self.inner is not None else -1
+
+    def expand(self, node, sym, prod):
+        expansion = self.grammar.expansion(prod)
+        if len(expansion) == 0:
+            print(f"Removed {self.grammar.names[sym]}")
+        else:
+            print(f"Expanded {self.grammar.names[sym]} to {self.grammar.decode(expansion)}")
+        if self.inner is not None:
+            self.inner.expand(node, sym, prod)
+
+    def force(self, node, sym, reason):
+        print(f"\nMax {reason} reached for {self.grammar.names[sym]}. Enforcing terminal expansion.")
+        sys.stdout.flush()
+        print("Entered forced terminal expansion")
+        if self.inner is not None:
+            self.inner.force(node, sym, reason)
+
+
+class TreeWriter:
+    '''
+    Appends trees to a binary file opened for writing ("wb"), or for appending ("ab", header=False) to a file that
+    already has its header.
+    '''
+
+    def __init__(self, file, grammar, header=True):
+        self.file = file
+        self.count = 0
+        if header:
+            file.write((json.dumps({"symbols": grammar.names}) + "\n").encode("utf-8"))
+
+    def write(self, tree):
+        array("i", [len(tree)]).tofile(self.file)
+        tree.parent.tofile(self.file)
+        tree.symbol.tofile(self.file)
+        tree.production.tofile(self.file)
+        self.file.write(tree.forced)
+        self.count += 1
+
+
+class TreeReader:
+    '''
+    Iterates over the trees of a file written by TreeWriter (opened "rb"); `names` maps symbol ids to names.
+    '''
+
+    def __init__(self, file):
+        self.file = file
+        self.names = json.loads(file.readline())["symbols"]
+
+    def __iter__(self):
+        while True:
+            size = array("i")
+            try:
+                size.fromfile(self.file, 1)
+            except EOFError:
+                return
+            n = size[0]
+            columns = []
+            for _ in range(3):
+                column = array("i")
+                column.fromfile(self.file, n)
+                columns.append(column)
+            yield DerivationTree(*columns, bytearray(self.file.read(n)))
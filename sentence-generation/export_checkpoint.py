@@ -0,0 +1,100 @@
+'''
+Checkpoints of an export run, so that an interrupted export resumes where it stopped
+
+A large export writes each tier file from start to end and keeps its progress in local variables, so a crash or a
+Ctrl-C at sentence 9,000,000 of the CS tier used to cost the whole run. With a checkpoint file, the exports save every
+`every` sentences (and at the end of each tier):
+
+    per tier    the number of sentences written, the byte offsets of the sentence (and tree) files at that point,
+                the deduplicator, the generation counters, and for the parallel export the next shard index and the
+                shards of the current batch still to be written
+    global      the state of the `random` module (the sequential export draws from it)
+
+A later run with the same settings skips the tiers that are complete, cuts the file of the interrupted tier back to
+the checkpointed offset (dropping whatever was written after the last checkpoint), reopens it in append mode and
+carries on from the saved state, so the files end up byte-identical to those of an uninterrupted run. Data files are
+flushed and fsynced before the checkpoint is replaced, and the checkpoint is replaced atomically, so it never points
+past what is on disk.
+
+The checkpoint is one pickle file (deduplicators hold sets and bit arrays); a checkpoint written with other settings
+is refused rather than resumed.
+'''
+
+import os
+import pickle
+import random
+
+
+def synced_size(file):
+    '''
+    Size in bytes of an output file once everything written to it is on disk (None for no file).
+    '''
+    if file is None:
+        return None
+    file.flush()
+    os.fsync(file.fileno())
+    return os.fstat(file.fileno()).st_size
+
+
+class ExportCheckpoint:
+    '''
+    Progress of one export run, kept in `path` (with path None nothing is saved and every tier starts fresh).
+    '''
+
+    def __init__(self, path, settings, every=100000):
+        self.path = path
+        self.settings = settings
+        self.every = every
+        self.tiers = {}
+        self.rng_state = None
+        self.saved_at = 0
+        if path is not None and os.path.exists(path):
+            with open(path, "rb") as f:
+                saved = pickle.load(f)
+            if saved["settings"] != settings:
+                raise ValueError(f"checkpoint {path} was written by an export with other settings: {saved['settings']}")
+            self.tiers = saved["tiers"]
+            self.rng_state = saved["rng_state"]
+
+    @property
+    def resuming(self):
+        return bool(self.tiers)
+
+    def complete(self, tier):
+        state = self.tiers.get(tier)
+        return state is not None and state["complete"]
+
+    def resume(self, tier, counters):
+        '''
+        Resets the counters of a tier to their checkpointed values; returns the saved state of the tier (None if it
+        has not been checkpointed, in which case it starts from scratch).
+        '''
+        counters.reset()
+        state = self.tiers.get(tier)
+        if state is not None:
+            counters.merge(state["counters"])
+        self.saved_at = state["count"] if state is not None else 0
+        return state
+
+    def due(self, count):
+        return self.path is not None and count - self.saved_at >= self.every
+
+    def save(self, tier, count, file, trees_file, deduplicator, counters, complete=False, **state):
+        '''
+        Records the state of a tier after `count` sentences (with any extra state given by keyword) and replaces the
+        checkpoint file.
+        '''
+        self.saved_at = count
+        if self.path is None:
+            return
+        self.tiers[tier] = dict(state, complete=complete, count=count, offset=synced_size(file),
+                                trees_offset=synced_size(trees_file), deduplicator=deduplicator,
+                                counters=counters.as_dict())
+        self.rng_state = random.getstate()
+        temporary = self.path + ".tmp"
+        with open(temporary, "wb") as f:
+            pickle.dump({"settings": self.settings, "tiers": self.tiers, "rng_state": self.rng_state}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
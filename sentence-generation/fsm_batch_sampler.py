@@ -0,0 +1,118 @@
+'''
+Batched NumPy sampler for the regular-grammar (fms_rules) tier
+
+generate_sentence_fsm draws one sentence at a time with a random.choice per state. The regular grammar has a fixed,
+finite skeleton (S -> NP VP rNP rVP rNP, each slot rewriting straight to preterminals), so a whole batch can be drawn
+with array operations instead: every slot of the skeleton is flattened once into a table of its alternative
+preterminal sequences, a batch picks one alternative per row and slot with a single vectorised draw, the chosen
+sequences are scattered into a padded matrix, and the words are gathered from the lexicon by index.
+
+Needs NumPy (as does batch_lexicaliser.py; the other generators run on the standard library).
+'''
+
+import itertools
+
+import numpy as np
+
+from batch_lexicaliser import PAD, BatchLexicaliser
+from compiled_grammar import NONTERMINAL
+from generate_sentences import compile_grammar
+
+
+class FSMBatchSampler:
+    '''
+    Draws batches of sentences from a non-recursive grammar (such as fms_rules), as token-id matrices or strings.
+
+    Each alternative has the probability generate_sentence_fsm gives it (every production of a symbol equally likely).
+    Token ids index grammar.vocab.
+    '''
+
+    def __init__(self, rules, lexicon=None):
+        grammar = compile_grammar(rules, lexicon)
+        self.grammar = grammar
+        self._flat = {}
+
+        # one entry per production of the start symbol: a (symbols, lengths, probabilities) table per slot
+        self.start_productions = []
+        self.start_probs = []
+        self.max_length = 0
+        for prod in grammar.productions(grammar.start):
+            slots = [self._slot_table(sym) for sym in grammar.expansion(prod)]
+            self.start_productions.append(slots)
+            self.start_probs.append(1.0 / len(grammar.productions(grammar.start)))
+            self.max_length = max(self.max_length, sum(symbols.shape[1] for symbols, _, _ in slots))
+
+        self.lexicaliser = BatchLexicaliser(grammar)
+
+    def _flatten(self, sym, visiting=()):
+        '''
+        Every preterminal sequence `sym` can derive, with its probability.
+        '''
+        grammar = self.grammar
+        if not grammar.kind[sym] & NONTERMINAL:
+            return [((sym,), 1.0)]
+        if sym in self._flat:
+            return self._flat[sym]
+        if sym in visiting:
+            raise ValueError(f"{grammar.names[sym]} is recursive; batch sampling needs a finite skeleton")
+
+        alternatives = []
+        prods = grammar.productions(sym)
+        for prod in prods:
+            parts = [self._flatten(child, visiting + (sym,)) for child in grammar.expansion(prod)]
+            for combination in itertools.product(*parts):
+                symbols = tuple(s for part, _ in combination for s in part)
+                prob = 1.0 / len(prods)
+                for _, part_prob in combination:
+                    prob *= part_prob
+                alternatives.append((symbols, prob))
+        self._flat[sym] = alternatives
+        return alternatives
+
+    def _slot_table(self, sym):
+        alternatives = self._flatten(sym)
+        width = max(len(symbols) for symbols, _ in alternatives)
+        table = np.full((len(alternatives), max(width, 1)), PAD, dtype=np.int32)
+        for k, (symbols, _) in enumerate(alternatives):
+            table[k, :len(symbols)] = symbols
+        lengths = np.array([len(symbols) for symbols, _ in alternatives], dtype=np.int64)
+        probs = np.array([prob for _, prob in alternatives])
+        probs /= probs.sum()
+        if np.allclose(probs, probs[0]):
+            probs = None  # uniform: rng.choice then draws plain integers instead of searching the cdf
+        return table, lengths, probs
+
+    def sample_ids(self, batch_size, rng=None):
+        '''
+        Returns (tokens, lengths): a (batch_size, max_length) int32 matrix of vocab ids, right-padded with PAD, and the
+        length of each row. `rng` is a numpy Generator or a seed.
+        '''
+        rng = np.random.default_rng(rng)
+        tokens = np.full((batch_size, self.max_length), PAD, dtype=np.int32)
+        lengths = np.zeros(batch_size, dtype=np.int64)
+
+        start_choice = rng.choice(len(self.start_productions), size=batch_size, p=self.start_probs)
+        for s, slots in enumerate(self.start_productions):
+            rows = np.flatnonzero(start_choice == s)
+            if not rows.size:
+                continue
+            flat = tokens.reshape(-1)
+            positions = rows * self.max_length  # flat index of the next free cell of each row
+            for table, slot_lengths, probs in slots:
+                choice = rng.choice(len(table), size=rows.size, p=probs)
+                symbols = table[choice]
+                # a slot's padding lands where the next slot starts, so the next slot overwrites it
+                for j in range(table.shape[1]):
+                    flat[positions + j] = symbols[:, j]
+                positions += slot_lengths[choice]
+            lengths[rows] = positions - rows * self.max_length
+
+        # lexicalise every filled slot at once: a uniform word of the slot's category
+        return self.lexicaliser.draw(tokens, rng), lengths
+
+    def sample_strings(self, batch_size, rng=None):
+        '''
+        Returns batch_size space-joined sentences.
+        '''
+        tokens, lengths = self.sample_ids(batch_size, rng)
+        return self.lexicaliser.decode(tokens, lengths)
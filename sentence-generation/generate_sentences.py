@@ -1,9 +1,11 @@
 import random
 import sys
 
+from compiled_grammar import CompiledGrammar, NONTERMINAL
+from derivation_trace import PrintTracer
 
 
-def generate_sentence_fsm(rules, lexicon, start_state="S", print_out=False):
+def generate_sentence_fsm(rules, lexicon, start_state="S", print_out=False, rng=random):
     '''
     Generates a sentence using FSM rules.
     '''
@@ -23,12 +25,12 @@ def generate_sentence_fsm(rules, lexicon, start_state="S", print_out=False):
                     if print_out:
                         print(f"Reached terminal symbol.")
                     continue
-                expansion = random.choice(expansions)
+                expansion = rng.choice(expansions)
                 if print_out:
                     print(f"Expanding {state} with {expansion}")
                 next_states.extend(expansion)
             elif state in lexicon:
-                word = random.choice(lexicon[state])
+                word = rng.choice(lexicon[state])
                 if print_out:
                     print(f"Replacing {state} with word '{word}'")
                 sentence.append(word)
@@ -43,855 +45,316 @@ def generate_sentence_fsm(rules, lexicon, start_state="S", print_out=False):
     return sentence
 
 
-def generate_sentence(rules, lexicon, symbols=None, max_expansion_per_symbol=10, max_recursion_depth=1e5, print_out=False):
-    if print_out:
-        print("\nStarting sentence generation\n")
-        sys.stdout.flush()
-
-    # start symbol mapping from "S" --> NP VP
-    start_expansions = rules["S"]
-    start_expansion = random.choice(start_expansions)
-    if print_out:
-        print("Initial expansion: ", start_expansion)
-    initial_symbols = start_expansion
+compiled_grammars = {}  # (id(rules), id(lexicon)) -> (rules, lexicon, CompiledGrammar), per process
 
-    # initialize a shared expansion_counts dictionary (expansion_counts needs to be shared across different recursive calls) per context symbol
-    expansion_counts = {}
 
-    sentence = []
-    for initial_symbol in initial_symbols:
+def compile_grammar(rules, lexicon):
+    '''
+    Returns `rules` as a CompiledGrammar (the generators accept either the raw rule dicts or a grammar compiled once up front).
 
-        if print_out:    
-            print("\nPartial symbol: \n", initial_symbol)
+    Raw dicts are compiled on their first use and the grammar is reused for every later call with the same two dict
+    objects, so its counters accumulate as they do for the grammars of main.py. The memo keeps the dicts alive (their
+    ids are not reused) and does not see changes made to them afterwards; pass a new CompiledGrammar after editing
+    the rules.
+    '''
+    if isinstance(rules, CompiledGrammar):
+        return rules
+    key = (id(rules), id(lexicon))
+    if key not in compiled_grammars:
+        compiled_grammars[key] = (rules, lexicon, CompiledGrammar(rules, lexicon))
+    return compiled_grammars[key][2]
 
-        part = get_expansion_cf([initial_symbol], rules, lexicon, max_expansion_per_symbol, expansion_counts, print_out, max_recursion_depth)
-        sentence.extend(part)
 
-        if print_out:
-            print("\nSentence part: \n", sentence)
-            sys.stdout.flush()
+def derive(symbols, grammar, max_expansion_per_symbol, expansion_counts=None, print_out=False,
+           max_recursion_depth=1e5, current_recursion_depth=0, rng=random, tracer=None, parent=-1):
+    '''
+    Derives `symbols` left to right down to preterminals with an explicit work stack (no recursion, no list splicing).
 
-    for i, sym in enumerate(sentence):
-        if sym in lexicon.keys():
-            sentence[i] = random.choice(lexicon[sym])
+    Each stack entry is a symbol and its depth in the derivation tree. A nonterminal is rewritten while its expansion
+    count (shared through `expansion_counts`) is below max_expansion_per_symbol and its depth is below max_recursion_depth,
+    otherwise forced_terminal_expansion maps it straight to preterminals. Preterminals are appended to the output
+    buffer in order, so the cost is linear in the size of the derivation.
 
+    With a tracer (see derivation_trace.py; print_out traces through a PrintTracer) every step is reported to it, the
+    new nodes hanging under node `parent`. Without one the loop below runs with no tracing checks at all.
+    '''
+    if expansion_counts is None:
+        expansion_counts = [0] * len(grammar)
     if print_out:
-        print("\nFinal sentence: ", sentence)
-    return sentence
+        tracer = PrintTracer(grammar, tracer)
+    if tracer is not None:
+        return derive_traced(symbols, grammar, max_expansion_per_symbol, expansion_counts, max_recursion_depth,
+                             current_recursion_depth, rng, tracer, parent)
+    kind = grammar.kind
+    prod_offsets = grammar.prod_offsets
+    rhs_offsets = grammar.rhs_offsets
+    rhs = grammar.rhs
+
+    output = []
+    stack = list(reversed(symbols))
+    depths = [current_recursion_depth] * len(stack)
+    while stack:
+        sym = stack.pop()
+        depth = depths.pop()
+
+        if not kind[sym] & NONTERMINAL:
+            output.append(sym)
+            continue
+
+        if expansion_counts[sym] < max_expansion_per_symbol and depth < max_recursion_depth:
+            expansion_counts[sym] += 1  # Increment the expansion count
+            if prod_offsets[sym] == prod_offsets[sym + 1]:
+                print(f"No expansions available for symbol {grammar.names[sym]}.")
+                output.append(sym)
+                continue
+            prod = grammar.choose(sym, rng)
+            # push the expansion reversed so that its leftmost symbol is derived next
+            for k in range(rhs_offsets[prod + 1] - 1, rhs_offsets[prod] - 1, -1):
+                stack.append(rhs[k])
+                depths.append(depth + 1)
+        else:
+            if expansion_counts[sym] >= max_expansion_per_symbol:
+                grammar.counters.forced["expansion count"] += 1
+            else:
+                grammar.counters.forced["recursion depth"] += 1
+            output.extend(forced_terminal_expansion([sym], grammar, rng=rng))
 
+    return output
 
-def get_expansion_cf(symbols, rules, lexicon, max_expansion_per_symbol, expansion_counts = None, print_out=False, 
-                    max_recursion_depth=1e5, current_recursion_depth=0):
-    if expansion_counts is None:
-        expansion_counts = {}
 
+def derive_traced(symbols, grammar, max_expansion_per_symbol, expansion_counts, max_recursion_depth,
+                  current_recursion_depth, rng, tracer, parent):
+    '''
+    derive, reporting every step to `tracer` (same choices, in the same order, from the same rng).
+    '''
+    kind = grammar.kind
+    output = []
+    stack = list(reversed(symbols))
+    depths = [current_recursion_depth] * len(stack)
+    parents = [parent] * len(stack)
+    while stack:
+        sym = stack.pop()
+        depth = depths.pop()
+        node = tracer.node(parents.pop(), sym)
+
+        if not kind[sym] & NONTERMINAL:
+            output.append(sym)
+            continue
+
+        if expansion_counts[sym] < max_expansion_per_symbol and depth < max_recursion_depth:
+            expansion_counts[sym] += 1
+            if grammar.prod_offsets[sym] == grammar.prod_offsets[sym + 1]:
+                print(f"No expansions available for symbol {grammar.names[sym]}.")
+                output.append(sym)
+                continue
+            prod = grammar.choose(sym, rng)
+            tracer.expand(node, sym, prod)
+            expansion = grammar.expansion(prod)
+            stack.extend(reversed(expansion))
+            depths.extend([depth + 1] * len(expansion))
+            parents.extend([node] * len(expansion))
+        else:
+            reason = "expansion count" if expansion_counts[sym] >= max_expansion_per_symbol else "recursion depth"
+            grammar.counters.forced[reason] += 1
+            tracer.force(node, sym, reason)
+            output.extend(forced_terminal_expansion([sym], grammar, rng=rng, tracer=tracer, nodes=[node]))
 
-    i = 0
-    while i < len(symbols):
-        sym = symbols[i]
-        # to limit the totoal number of expansions of all symbols (limited futher from each symbols)
+    return output
 
-        if sym in rules:
-            # Initialize count if symbol not yet expanded
-            if sym not in expansion_counts:
-                expansion_counts[sym] = 0
-            
-            if expansion_counts[sym] < max_expansion_per_symbol and current_recursion_depth < max_recursion_depth:
-                expansion_counts[sym] += 1  # Increment the expansion count
 
-                expansions = rules[sym]
-                if not expansions:
-                    print(f"No expansions available for symbol {sym}.")
-                    i += 1
-                    continue
-                expansion = random.choice(expansions)
-                
-                if isinstance(expansion, str):
-                    expansion = [expansion]
-                elif expansion is None:
-                    expansion = []
-                elif not isinstance(expansion, list):
-                    expansion = list(expansion)
-
-                if expansion == []:
-                    # remove that symbol
-                    symbols = symbols[:i] + symbols[i+1:]
-                    if print_out:
-                        print(f"Removed {sym}, now symbols: {symbols}")
-                else:
-                    symbols = symbols[:i] + expansion + symbols[i+1:]
-                    if print_out:
-                        print(f"Expanded {sym} to {expansion}") 
-
-                    # recursively expand the newly added symbols
-                    j = i
-                    while j < i + len(expansion):
-                        if symbols[j] in rules:
-                            # recursively expand the symbol ('NoneType' errors can be incurred if the while loop completes 
-                            # without triggering any of the return statements inside the conditional blocks )
-                            new_symbols = get_expansion_cf(
-                                [symbols[j]], rules, lexicon, 
-                                max_expansion_per_symbol, expansion_counts, print_out,
-                                max_recursion_depth, current_recursion_depth + 1
-                            )
-                            
-                            if new_symbols is not None and new_symbols != []:
-                                symbols = symbols[:j] + new_symbols + symbols[j+1:]
-                            else:
-                                # if recursion expansion returns empty, remove the symbol
-                                symbols = symbols[:j] + symbols[j+1:]
-                        j += 1
-                    i += len(expansion)
-            elif expansion_counts[sym] >= max_expansion_per_symbol:
-                if print_out:
-                    print(f"\nMax expansion count reached for {sym}. Enforcing terminal expansion.")
-                    sys.stdout.flush()
-                    print("Symbols: ", symbols)
-                # enforce terminal expansion for the remaining symbols
-                # while any are in the keys of the rules, since we are mapping to the symbols in the lexicon and then afterward mapping to the terminal
-                symbols = forced_terminal_expansion_cf(symbols, lexicon, print_out)   
-                return symbols  
-            else:
-                if print_out:
-                    print(f"\nMax recursion depth reached for {sym}. Enforcing terminal expansion.")
-                    sys.stdout.flush()
-                    print("Symbols: ", symbols)
-                for i, sym in enumerate(symbols):
-                    syms = forced_terminal_expansion_cf(sym, rules, lexicon, print_out)
-                    if isinstance(syms, list):
-                        symbols = symbols[:i] + syms + symbols[i+1:]
-                    else:
-                        symbols = symbols[:i] + [syms] + symbols[i+1:]
-                return symbols
-        else:
-            i += 1  
+def start_node(tracer, grammar, start_prod):
+    '''
+    Begins a traced derivation: records the start symbol and its production; returns the root node (-1 untraced).
+    '''
+    if tracer is None:
+        return -1
+    tracer.begin()
+    root = tracer.node(-1, grammar.start)
+    tracer.expand(root, grammar.start, start_prod)
+    return root
 
-    return symbols
 
-def forced_terminal_expansion_cf(sym, rules, lexicon, print_out=False):
+def generate_sentence(rules, lexicon, symbols=None, max_expansion_per_symbol=10, max_recursion_depth=1e5, print_out=False, rng=random, tracer=None, lexicalise=True):
     if print_out:
-        print("\nEntered forced terminal expansion\n")
+        print("\nStarting sentence generation\n")
         sys.stdout.flush()
+    grammar = compile_grammar(rules, lexicon)
 
+    # start symbol mapping from "S" --> NP VP
+    start_prod = grammar.choose(grammar.start, rng)
+    start_expansion = grammar.expansion(start_prod)
+    root = start_node(tracer, grammar, start_prod)
+    if print_out:
+        print("Initial expansion: ", grammar.decode(start_expansion))
+    initial_symbols = start_expansion
 
-    if sym == "NP" or sym == "VP":
-        # quickest to terminal  NP --> NP_sg or NP_pl, NP_sg --> Det N_sg, NP_pl --> Det N_pl
+    # initialize a shared expansion_counts table (expansion_counts needs to be shared across different recursive calls) per context symbol
+    expansion_counts = [0] * len(grammar)
 
-        epsilon = random.uniform(0, 1)
+    sentence = []
+    for initial_symbol in initial_symbols:
 
-        if sym == "NP":
-            epsilon2 = random.uniform(0, 1)
-            if epsilon < 0.75:
-                if epsilon2 < 0.5:
-                    if print_out:
-                        print(f"Expanded {sym} via {epsilon:.2f} to ['Det_sg', 'N_sg']")
-                    sym = ["Det_sg", "N_sg"]
-                else:
-                    if print_out:
-                        print(f"Expanded {sym} via {epsilon:.2f} to ['Det_pl', 'N_pl']")
-                    sym = ["Det_pl", "N_pl"]
-            else:
-                if print_out:
-                    print(f"Expanded {sym} via {epsilon:.2f} to ['ProperNoun_sg']")
-                sym = ["ProperNoun_sg"]
+        if print_out:    
+            print("\nPartial symbol: \n", grammar.names[initial_symbol])
 
-        if sym == "VP":
-            if epsilon < 0.5:
-                if print_out:
-                    print(f"Expanded {sym} via {epsilon:.2f} to ['V_sg']")
-                sym = ["V_sg"]
-            else:
-                if print_out:
-                    print(f"Expanded {sym} via {epsilon:.2f} to ['V_pl']")
-                sym = ["V_pl"]
-
-    #### SINGULAR ####
-    if sym == "NP_sg" or sym == "VP_sg" or sym == "NP_conj_sg" or sym == "VP_sg" or sym == "VP_conj_sg" or sym == "PP_conj" or sym == "PP":
-        
-        if sym == "NP_sg" or sym == "NP_conj_sg": # in this case, we just make NP singular
-            epsilon = random.uniform(0, 1)
-            if epsilon < 0.67:
-                epsilon2 = random.uniform(0, 1)
-                if epsilon2 < 0.5:
-                    if print_out:
-                        print(f"Expanded {sym} via {epsilon:.2f}, {epsilon2:.2f} to ['Det_sg', 'Adj', 'N_sg']")
-                    sym = ["Det_sg", "Adj", "N_sg"]
-                else:
-                    if print_out:
-                        print(f"Expanded {sym} via {epsilon:.2f}, {epsilon2:.2f} to ['Det_sg', 'N_sg']")
-                    sym = ["Det_sg", "N_sg"]
-            else:
-                if print_out:
-                    print(f"Expanded {sym} via {epsilon:.2f} to ['ProperNoun_sg']")
-                sym = ["ProperNoun_sg"]
-
-        if sym == "VP_sg":
-            if print_out:
-                print(f"Expanded {sym} to ['V_sg']")
-            sym = ["V_sg"]
-
-        if sym == "VP_conj_sg":
-            if print_out:
-                print(f"Expanded {sym}to ['Conj', 'V_sg']")
-            sym = ["Conj", "V_sg"]
-
-        if sym == "PP":
-            # PP --> P NP, NP --> Det_sg N_sg
-            if print_out:
-                print(f"Expanded {sym} to ['P', 'Det_sg', 'N_sg']")
-            sym = ["P", "Det_sg", "N_sg"]
-        
-        if sym == "PP_conj":
-            # PP_conj --> Conj PP, PP --> P, Det_sg, N_sg 
-            if print_out:
-                print(f"Expanded {sym} to ['Conj', 'P', 'Det_sg', 'N_sg']")
-            sym = ["Conj", "P", "Det_sg", "N_sg"]
-                
-    ### PLURAL ###
-    if sym == "NP_pl" or sym == "VP_pl" or sym == "NP_conj_pl" or sym == "VP_conj_pl":
-        
-        if sym == "NP_pl" or sym == "NP_conj_pl":
-            epsilon = random.uniform(0, 1)
-            if epsilon < 0.5:
-                if print_out:
-                    print(f"Expanded {sym} via {epsilon:.2f} to ['Det_pl', 'Adj', 'N_pl']")
-                sym = ["Det_pl", "Adj", "N_pl"]
-            else:
-                if print_out:
-                    print(f"Expanded {sym} via {epsilon:.2f} to ['Det_pl', 'N_pl']")
-                sym = ["Det_pl", "N_pl"]
+        part = get_expansion_cf([initial_symbol], grammar, max_expansion_per_symbol, expansion_counts, print_out, max_recursion_depth, rng=rng, tracer=tracer, parent=root)
+        sentence.extend(part)
+
+        if print_out:
+            print("\nSentence part: \n", grammar.decode(sentence))
+            sys.stdout.flush()
 
-        if sym == "VP_pl":
-            if print_out:
-                print(f"Expanded {sym} to ['V_pl']")
-            sym = ["V_pl"]
+    if lexicalise:
+        sentence = grammar.lexicalise(sentence, rng)
+
+    if print_out:
+        print("\nFinal sentence: ", sentence)
+    return sentence
 
-        if sym == "VP_conj_pl":
-            if print_out:
-                print(f"Expanded {sym} to ['Conj', 'V_pl']")
-            sym = ["Conj", "V_pl"]
-        
-    return sym
 
+def get_expansion_cf(symbols, grammar, max_expansion_per_symbol, expansion_counts = None, print_out=False, 
+                    max_recursion_depth=1e5, current_recursion_depth=0, rng=random, tracer=None, parent=-1):
+    return derive(symbols, grammar, max_expansion_per_symbol, expansion_counts, print_out,
+                  max_recursion_depth, current_recursion_depth, rng, tracer, parent)
 
-def generate_sentence_noncf(rules, lexicon, symbols=None, max_expansion_per_symbol=10, max_recursion_depth=1e5, print_out=False):
+def generate_sentence_noncf(rules, lexicon, symbols=None, max_expansion_per_symbol=10, max_recursion_depth=1e5, print_out=False, rng=random, tracer=None, lexicalise=True):
     if print_out:
         print("\nStarting sentence generation\n")
         sys.stdout.flush()
 
+    grammar = compile_grammar(rules, lexicon)
+
     # Start symbol mapping from "S"
-    start_expansions = rules["S"]
-    start_expansion = random.choice(start_expansions)
+    start_prod = grammar.choose(grammar.start, rng)
+    start_expansion = grammar.expansion(start_prod)
+    root = start_node(tracer, grammar, start_prod)
     if print_out:
-        print("Initial expansion: ", start_expansion)
+        print("Initial expansion: ", grammar.decode(start_expansion))
     initial_symbols = start_expansion 
     ## by starting expansions of the relations between singular and plural, the relations are maintained, since S --> NP_sg VP_sg | NP_pl VP_pl
 
     sentence = []
     for initial_symbol in initial_symbols:
-        # initialize a shared expansion_counts dictionary (expansion_counts needs to be shared across different recursive calls) per context symbol
-        expansion_counts = {}
+        # initialize a shared expansion_counts table (expansion_counts needs to be shared across different recursive calls) per context symbol
+        expansion_counts = [0] * len(grammar)
 
         if print_out:    
-            print("\nPartial symbol: \n", initial_symbol)
+            print("\nPartial symbol: \n", grammar.names[initial_symbol])
 
-        part = get_expansion_noncf([initial_symbol], rules, lexicon, max_expansion_per_symbol, expansion_counts, print_out, max_recursion_depth)
+        part = get_expansion_noncf([initial_symbol], grammar, max_expansion_per_symbol, expansion_counts, print_out, max_recursion_depth, rng=rng, tracer=tracer, parent=root)
         sentence.extend(part)
 
         if print_out:
-            print("\nSentence part: \n", sentence)
+            print("\nSentence part: \n", grammar.decode(sentence))
             sys.stdout.flush()
 
-    for i, sym in enumerate(sentence):
-        if sym in lexicon.keys():
-            sentence[i] = random.choice(lexicon[sym])
+    if lexicalise:
+        sentence = grammar.lexicalise(sentence, rng)
 
     if print_out:
         print("\nFinal sentence: ", sentence)
     return sentence
 
 
-def get_expansion_noncf(symbols, rules, lexicon, max_expansion_per_symbol, expansion_counts = None, print_out=False, 
-                    max_recursion_depth=1e5, current_recursion_depth=0):
-    if expansion_counts is None:
-        expansion_counts = {}
-
-    i = 0
-    while i < len(symbols):
-        sym = symbols[i]
-        # to limmit the totoal number of expansions of all symbols (limited futher from each symbols)
-        if sym in rules:
-            # Initialize count if symbol not yet expanded
-            if sym not in expansion_counts:
-                expansion_counts[sym] = 0
+def get_expansion_noncf(symbols, grammar, max_expansion_per_symbol, expansion_counts = None, print_out=False, 
+                    max_recursion_depth=1e5, current_recursion_depth=0, rng=random, tracer=None, parent=-1):
+    return derive(symbols, grammar, max_expansion_per_symbol, expansion_counts, print_out,
+                  max_recursion_depth, current_recursion_depth, rng, tracer, parent)
             
-            if expansion_counts[sym] < max_expansion_per_symbol and current_recursion_depth < max_recursion_depth:
-                expansion_counts[sym] += 1  # Increment the expansion count
 
-                expansions = rules[sym]
-                if not expansions:
-                    print(f"No expansions available for symbol {sym}.")
-                    i += 1
-                    continue
-                expansion = random.choice(expansions)
-                
-                if isinstance(expansion, str):
-                    expansion = [expansion]
-                elif expansion is None:
-                    expansion = []
-                elif not isinstance(expansion, list):
-                    expansion = list(expansion)
-
-                if expansion == []:
-                    # remove that symbol
-                    symbols = symbols[:i] + symbols[i+1:]
-                    if print_out:
-                        print(f"Removed {sym}, now symbols: {symbols}")
-                else:
-                    symbols = symbols[:i] + expansion + symbols[i+1:]
-                    if print_out:
-                        print(f"Expanded {sym} to {expansion}") 
-
-                    # recursively expand the newly added symbols
-                    j = i
-                    while j < i + len(expansion):
-                        if symbols[j] in rules:
-                            # recursively expand the symbol ('NoneType' errors can be incurred if the while loop completes 
-                            # without triggering any of the return statements inside the conditional blocks )
-                            new_symbols = get_expansion_noncf(
-                                [symbols[j]], rules, lexicon, 
-                                max_expansion_per_symbol, expansion_counts, print_out,
-                                max_recursion_depth, current_recursion_depth + 1
-                            )
-                            
-                            if new_symbols is not None and new_symbols != []:
-                                symbols = symbols[:j] + new_symbols + symbols[j+1:]
-                            else:
-                                # if recursion expansion returns empty, remove the symbol
-                                symbols = symbols[:j] + symbols[j+1:]
-                        j += 1
-                    i += len(expansion)
-            elif expansion_counts[sym] >= max_expansion_per_symbol:
-                if print_out:
-                    print(f"\nMax expansion count reached for {sym}. Enforcing terminal expansion.")
-                    sys.stdout.flush()
-                    print("Symbols: ", symbols)
-                # enforce terminal expansion for the remaining symbols
-                # while any are in the keys of the rules, since we are mapping to the symbols in the lexicon and then afterward mapping to the terminal
-                symbols = forced_terminal_expansion_mcs(symbols, lexicon, print_out)   
-                return symbols  
-            else:
-                if print_out:
-                    print(f"\nMax recursion depth reached for {sym}. Enforcing terminal expansion.")
-                    sys.stdout.flush()
-                    print("Symbols: ", symbols)
-                symbols = forced_terminal_expansion_mcs(symbols, lexicon, print_out)
-                return symbols
-        else:
-            i += 1  
-
-    return symbols
-            
-
-def forced_terminal_expansion_mcs(symbols, lexicon, print_out=False):
-    if print_out:
-        print("Entered forced terminal expansion")
-    lexicon_keys = lexicon.keys()
-    lexicon_values = lexicon.values()
-    non_lex = True
-    while non_lex:
-        # if max expansion is reached, force terminals that agree with the rules
-        for sym in symbols:
-
-            if sym == "NP" or sym == "VP":
-                # quickest to terminal  NP --> NP_sg or NP_pl, NP_sg --> Det N_sg, NP_pl --> Det N_pl
-                where = symbols.index(sym)
-                epsilon = random.uniform(0, 1)
-                if sym == "NP":
-                    epsilon2 = random.uniform(0, 1)
-                    if epsilon < 0.75:
-                        if epsilon2 < 0.5:
-                            symbols = symbols[:where] + ["Det_sg", "N_sg"] + symbols[where + 1:]
-                            if print_out:
-                                print(f"Expanded {sym} via {epsilon:.2f} to ['Det_sg', 'N_sg']")
-                            where += 1
-                        else:
-                            symbols = symbols[:where] + ["Det_pl", "N_pl"] + symbols[where + 1:]
-                            if print_out:
-                                print(f"Expanded {sym} via {epsilon:.2f} to ['Det_pl', 'N_pl']")
-                            where += 1
-                    else:
-                        symbols = symbols[:where] + ["ProperNoun_sg"] + symbols[where + 1:]
-                        if print_out:
-                            print(f"Expanded {sym} via {epsilon:.2f} to ['ProperNoun_sg']")
-
-                if sym == "VP":
-                    if epsilon < 0.5:
-                        symbols = symbols[:where] + ["V_sg"] + symbols[where + 1:]
-                        if print_out:
-                            print(f"Expanded {sym} via {epsilon:.2f} to ['V_sg']")
-                    else:
-                        symbols = symbols[:where] + ["V_pl"] + symbols[where + 1:]
-                        if print_out:
-                            print(f"Expanded {sym} via {epsilon:.2f} to ['V_pl']")
-
-                # English restriction : check for preceding determiner to avoid duplication (uncomment this for a slight deviation closer to English)
-                if where > 0 and symbols[where-1] in ["Det_sg", "Det_pl"]:
-                    if print_out:
-                        print(f"Skipped inserting determiner before position {where} to avoid duplication.")
-                    continue  # skip insertion to prevent duplication
-
-            #### SINGULAR ####
-            if sym == "NP_sg" or sym == "VP_sg" or sym == "NP_conj_sg" or sym == "RC_sg" or sym == "VP_sg" or sym == "VP_conj_sg" or sym == "PP_conj" or sym == "PP":
-                where = symbols.index(sym)
-                
-                if sym == "NP_sg" or sym == "NP_conj_sg": # in this case, we just make NP singular
-                    epsilon = random.uniform(0, 1)
-                    if epsilon < 0.67:
-                        epsilon2 = random.uniform(0, 1)
-                        if epsilon2 < 0.5:
-                            symbols = symbols[:where] + ["Det_sg", "Adj", "N_sg"] + symbols[where + 1:]
-                            if print_out:
-                                print(f"Expanded {sym} via {epsilon:.2f}, {epsilon2:.2f} to ['Det_sg', 'Adj', 'N_sg']")
-                            where += 2
-                        else:
-                            symbols = symbols[:where] + ["Det_sg", "N_sg"] + symbols[where + 1:]
-                            if print_out:
-                                print(f"Expanded {sym} via {epsilon:.2f}, {epsilon2:.2f} to ['Det_sg', 'N_sg']")
-                            where += 1
-                    else:
-                        symbols = symbols[:where] + ["ProperNoun_sg"] + symbols[where + 1:]
-                        if print_out:
-                            print(f"Expanded {sym} via {epsilon:.2f} to ['ProperNoun_sg']")
-                    ### for nested and cross-serial dependencies (coordinated phrases) check if the next symbol is a verb phrase, if so, expand that now before continuing
-                    if where + 1 < len(symbols):
-                        if symbols[where + 1] == "Adv":
-                            where += 1
-                        if symbols[where + 1] == "VP_sg" or symbols[where + 1] == "VP":
-                            if where + 2 < len(symbols):
-                                symbols = symbols[:where + 1] + ["V_sg"] + symbols[where + 2:]
-                                if print_out:
-                                    print(f"Expanded VP_sg to ['V_sg']")
-                            else:
-                                symbols = symbols = symbols[:where + 1] + ["V_sg"]
-                                if print_out:
-                                    print(f"Expanded VP_sg to ['V_sg']")
-
-                if sym == "VP_sg":
-                    symbols = symbols[:where] + ["V_sg"] + symbols[where + 1:]
-                    if print_out:
-                        print(f"Expanded {sym} to ['V_sg']")
-
-                if sym == "VP_conj_sg":
-                    symbols = symbols[:where] + ["Conj", "V_sg"] + symbols[where + 1:]
-                    if print_out:
-                            print(f"Expanded {sym}to ['Conj', 'V_sg']")
-
-                if sym == "PP":
-                    # PP --> P, Det_sg, N_sg
-                    symbols = symbols[:where] + ["P", "Det_sg", "N_sg"] + symbols[where + 1:]
-                    if print_out:
-                        print(f"Expanded {sym} to ['P', 'Det_sg', 'N_sg']")
-
-                if sym == "PP_conj":
-                    # PP_conj --> Conj PP, PP --> P, Det_sg, N_sg 
-                    symbols = symbols[:where] + ["Conj", "P", "Det_sg", "N_sg"] + symbols[where + 1:]
-                    if print_out:
-                        print(f"Expanded {sym} to ['Conj', 'P', 'Det_sg', 'N_sg']")
-
-                if sym == "RC_sg":
-                    symbols = symbols[:where] + ["RelPronoun", "V_sg"] + symbols[where + 1:]
-                    if print_out:
-                        print(f"Expanded {sym} to ['RelPronoun', 'V_sg']")
-                        
-    
-
-            ### PLURAL ###
-            if sym == "NP_pl" or sym == "VP_pl" or sym == "NP_conj_pl" or sym == "RC_pl" or sym == "VP_conj_pl":
-                where = symbols.index(sym)
-                
-                if sym == "NP_pl" or sym == "NP_conj_pl":
-                    epsilon = random.uniform(0, 1)
-                    if epsilon < 0.5:
-                        symbols = symbols[:where] + ["Det_pl", "Adj", "N_pl"] + symbols[where + 1:]
-                        if print_out:
-                            print(f"Expanded {sym} via {epsilon:.2f} to ['Det_pl', 'Adj', 'N_pl']")
-                        where += 2
-                    else:
-                        symbols = symbols[:where] + ["Det_pl", "N_pl"] + symbols[where + 1:]
-                        if print_out:
-                            print(f"Expanded {sym} via {epsilon:.2f} to ['Det_pl', 'N_pl']")
-                        where += 1
-                    ### for nested and cross-serial dependencies (coordinated phrases) check if the next symbol is a verb phrase, if so, expand that now before continuing
-                    if where + 1 < len(symbols):
-                        if symbols[where + 1] == "Adv":
-                            where += 1
-                        if symbols[where + 1] == "VP_pl" or symbols[where + 1] == "VP":
-                            if where + 2 < len(symbols):
-                                symbols = symbols[:where + 1] + ["V_pl"] + symbols[where + 2:]
-                                if print_out:
-                                    print(f"Expanded VP_pl to ['V_pl']")
-                            else:
-                                symbols = symbols = symbols[:where + 1] + ["V_pl"]
-                                if print_out:
-                                    print(f"Expanded VP_pl to ['V_pl']")
-
-                if sym == "VP_pl":
-                    symbols = symbols[:where] + ["V_pl"] + symbols[where + 1:]
-                    if print_out:
-                        print(f"Expanded {sym} to ['V_pl']")
-
-                if sym == "VP_conj_pl":
-                    symbols = symbols[:where] + ["Conj", "V_pl"] + symbols[where + 1:]
-                    if print_out:
-                        print(f"Expanded {sym} to ['Conj', 'V_pl']")
-
-                if sym == "RC_pl":
-                    symbols = symbols[:where] + ["RelPronoun", "V_pl"] + symbols[where + 1:]
-                    if print_out:
-                        print(f"Expanded {sym} to ['RelPronoun', 'V_pl']")
-
-
-        
-        non_lex = any(sym not in lexicon for sym in symbols)
-        if print_out:
-            print("Symbols: ", symbols)
-            print("Non lexicon: ", non_lex)
-    return symbols
-
-
-def generate_sentence_recursion_limits(rules, lexicon, symbols=None, max_expansion_per_symbol=10, max_recursion_depth=1e5, print_out=False):
+def generate_sentence_recursion_limits(rules, lexicon, symbols=None, max_expansion_per_symbol=10, max_recursion_depth=1e5, print_out=False, rng=random, tracer=None, lexicalise=True):
     if print_out:
         print("\n --Starting sentence generation-- \n")
         sys.stdout.flush()
 
 
+    grammar = compile_grammar(rules, lexicon)
+
     # Start symbol mapping from "S"
-    start_expansions = rules["S"]
-    start_expansion = tuple(start_expansions[0])
+    start_prod = grammar.prod_offsets[grammar.start]
+    start_expansion = tuple(grammar.expansion(start_prod))
+    root = start_node(tracer, grammar, start_prod)
     if print_out:
-        print("Initial expansion: ", start_expansion)
+        print("Initial expansion: ", tuple(grammar.decode(start_expansion)))
     initial_symbols = start_expansion
 
     # Initial expansion from context-sensitive production branches
-    cs_rule = initial_symbols
-    context_expansions = rules[initial_symbols]
-    context_expansion = random.choice(context_expansions)
+    cs_rule = grammar.contexts[initial_symbols]
+    context_prod = grammar.choose(cs_rule, rng)
+    context_expansion = grammar.expansion(context_prod)
+    if tracer is not None:
+        # the context symbol replaces the start expansion it matched, as a single child of the root
+        root = tracer.node(root, cs_rule)
+        tracer.expand(root, cs_rule, context_prod)
     if print_out:
-        print("Context expansion: ", context_expansion)
+        print("Context expansion: ", grammar.decode(context_expansion))
     context_symbols = context_expansion
 
     sentence = []
     for context_symbol in context_symbols:
-        # initialize a shared expansion_counts dictionary (expansion_counts needs to be shared across different recursive calls) per context symbol
-        expansion_counts = {}
+        # initialize a shared expansion_counts table (expansion_counts needs to be shared across different recursive calls) per context symbol
+        expansion_counts = [0] * len(grammar)
 
         if print_out:    
-            print("\nContext symbol: \n", context_symbol)
+            print("\nContext symbol: \n", grammar.names[context_symbol])
             
-        part = get_expansion([context_symbol], rules, lexicon, max_expansion_per_symbol, expansion_counts, print_out, max_recursion_depth)
+        part = get_expansion([context_symbol], grammar, max_expansion_per_symbol, expansion_counts, print_out, max_recursion_depth, rng=rng, tracer=tracer, parent=root)
         sentence.extend(part)
 
         if print_out:
-            print("\nSentence part: ", sentence)
+            print("\nSentence part: ", grammar.decode(sentence))
             sys.stdout.flush()
 
-    for i, sym in enumerate(sentence):
-        if sym in lexicon.keys():
-            sentence[i] = random.choice(lexicon[sym])
+    if lexicalise:
+        sentence = grammar.lexicalise(sentence, rng)
 
     if print_out:
         print("\nFinal sentence: ", sentence)
     return sentence
 
 
-def get_expansion(symbols, rules, lexicon, max_expansion_per_symbol, expansion_counts = None, print_out=False, 
-                    max_recursion_depth=1e5, current_recursion_depth=0):
-    if expansion_counts is None:
-        expansion_counts = {}
-
-    i = 0
-    while i < len(symbols):
-        sym = symbols[i]
-        # to limmit the totoal number of expansions of all symbols (limited futher from each symbols)
-        if sym in rules:
-            # Initialize count if symbol not yet expanded
-            if sym not in expansion_counts:
-                expansion_counts[sym] = 0
+def get_expansion(symbols, grammar, max_expansion_per_symbol, expansion_counts = None, print_out=False, 
+                    max_recursion_depth=1e5, current_recursion_depth=0, rng=random, tracer=None, parent=-1):
+    return derive(symbols, grammar, max_expansion_per_symbol, expansion_counts, print_out,
+                  max_recursion_depth, current_recursion_depth, rng, tracer, parent)
             
-            if expansion_counts[sym] < max_expansion_per_symbol and current_recursion_depth < max_recursion_depth:
-                expansion_counts[sym] += 1  # Increment the expansion count
 
-                expansions = rules[sym]
-                if not expansions:
-                    print(f"No expansions available for symbol {sym}.")
-                    i += 1
-                    continue
-                expansion = random.choice(expansions)
-                
-                if isinstance(expansion, str):
-                    expansion = [expansion]
-                elif expansion is None:
-                    expansion = []
-                elif not isinstance(expansion, list):
-                    expansion = list(expansion)
-
-                if expansion == []:
-                    # remove that symbol
-                    symbols = symbols[:i] + symbols[i+1:]
-                    if print_out:
-                        print(f"Removed {sym}, now symbols: {symbols}")
-                else:
-                    symbols = symbols[:i] + expansion + symbols[i+1:]
-                    if print_out:
-                        print(f"Expanded {sym} to {expansion}") 
-
-                    # recursively expand the newly added symbols
-                    j = i
-                    while j < i + len(expansion):
-                        if symbols[j] in rules:
-                            # recursively expand the symbol ('NoneType' errors can be incurred if the while loop completes 
-                            # without triggering any of the return statements inside the conditional blocks )
-                            new_symbols = get_expansion(
-                                [symbols[j]], rules, lexicon, 
-                                max_expansion_per_symbol, expansion_counts, print_out,
-                                max_recursion_depth, current_recursion_depth + 1
-                            )
-                            
-                            if new_symbols is not None and new_symbols != []:
-                                symbols = symbols[:j] + new_symbols + symbols[j+1:]
-                            else:
-                                # if recursion expansion returns empty, remove the symbol
-                                symbols = symbols[:j] + symbols[j+1:]
-                        j += 1
-                    i += len(expansion)
-            elif expansion_counts[sym] >= max_expansion_per_symbol:
-                if print_out:
-                    print(f"\nMax expansion count reached for {sym}. Enforcing terminal expansion.")
-                    # sys.stdout.flush()
-                    print("Symbols: ", symbols)
-                # enforce terminal expansion for the remaining symbols
-                # while any are in the keys of the rules, since we are mapping to the symbols in the lexicon and then afterward mapping to the terminal
-                symbols = forced_terminal_expansion(symbols, lexicon, print_out)   
-                return symbols  
-            else:
-                if print_out:
-                    print(f"\nMax recursion depth reached for {sym}. Enforcing terminal expansion.")
-                    # sys.stdout.flush()
-                    print("Symbols: ", symbols)
-                symbols = forced_terminal_expansion(symbols, lexicon, print_out)
-                return symbols
-        else:
-            i += 1  
+def forced_terminal_expansion(symbols, grammar, print_out=False, rng=random, tracer=None, nodes=None):
+    '''
+    Maps every nonterminal of `symbols` to preterminals in one left-to-right pass.
 
-    return symbols
-            
+    Each nonterminal is rewritten with one of its shortest-terminal productions (grammar.forced_prods, computed from the
+    rules by a min-depth fixpoint) until only preterminals are left. The depth strictly decreases along those
+    productions, so this terminates for any grammar, and it follows the rules when they are edited.
 
-def forced_terminal_expansion(symbols, lexicon, print_out=False):
+    A tracer gets the forced steps too; `nodes` are the tracer's nodes of `symbols` if they are already recorded.
+    '''
     if print_out:
         print("Entered forced terminal expansion")
-    lexicon_keys = lexicon.keys()
-    lexicon_values = lexicon.values()
-    non_lex = True
-    while non_lex:
-        # if max expansion is reached, force terminals that agree with the rules
-        for sym in symbols:
-                # if max_expansion is minimal, then start from S --> NP_seq VP_seq
-                # so, if sym == ["NP_sequence", "VP_placeholder"] then expand to either NP_sg, NP VP_sg or NP_pl NP VP_pl (let VP_seq = [] in this forced terminal case)
-                if sym == ("NP_sequence", "VP_placeholder") or sym == ["NP_sequence", "VP_placeholder"]: # this will be taken care of before this forced terminal section is reached, but incase the initialization gets changed
-                    where = symbols.index(sym)
-                    epsilon = random.uniform(0, 1)
-                    if epsilon < 0.5:
-                        epsilon2 = random.uniform(0, 1)
-                        epsilon2 = random.uniform(0, 1)
-                        if epsilon2 < 0.5:
-                            symbols = symbols[:where] + ["NP_sg", "NP_sg", "VP_sg"] + symbols[where + 1:]
-                            if print_out:
-                                print(f"Expanded {sym} via {epsilon:.2f}, {epsilon2:.2f} to ['NP_sg', 'NP_sg', 'VP_sg']")
-                        else:
-                            symbols = symbols[:where] + ["NP_sg", "NP_pl", "VP_sg"] + symbols[where + 1:]
-                            if print_out:
-                                print(f"Expanded {sym} via {epsilon:.2f}, {epsilon2:.2f} to ['NP_sg', 'NP_pl', 'VP_sg']")
-                    elif epsilon >= 0.5:
-                        epsilon2 = random.uniform(0, 1)
-                        if epsilon2 < 0.5:
-                            symbols = symbols[:where] + ["NP_pl", "NP_sg", "VP_pl"] + symbols[where + 1:]
-                            if print_out:
-                                print(f"Expanded {sym} via {epsilon:.2f}, {epsilon2:.2f} to ['NP_pl', 'NP_sg', 'VP_pl']")
-                        else:
-                            symbols = symbols[:where] + ["NP_pl", "NP_pl", "VP_pl"] + symbols[where + 1:]
-                            if print_out:
-                                print(f"Expanded {sym} via {epsilon:.2f}, {epsilon2:.2f} to ['NP_pl', 'NP_pl', 'VP_pl']")
-
-                if sym == "NP_sequence": 
-                    # for context-dependence, if there is a "VP_sg" or a "VP_pl" directly succeeding this symbol, change that first
-                    # so that the agreement is maintained before additional expansions loses track of the corresponding verb phrase
-                    where = symbols.index(sym)
-                    if where + 1 < len(symbols):
-                        if symbols[where + 1] == "VP_sg":
-                            if epsilon < 0.5:
-                                if where + 2 < len(symbols):
-                                    symbols = symbols[:where + 1] + ["V_sg"] + symbols[where + 2:]
-                                    if print_out:
-                                        print(f"Expanded {sym} via {epsilon:.2f} to ['V_sg']")
-                                else:
-                                    symbols = symbols[:where + 1] + ["Adv", "V_sg"]
-                                    if print_out:
-                                        print(f"Expanded {sym} via {epsilon:.2f} to ['Adv', 'V_sg']")
-                        if symbols[where + 1] == "VP_pl":
-                            if epsilon < 0.5:
-                                if where + 2 < len(symbols):
-                                    symbols = symbols[:where + 1] + ["V_pl"] + symbols[where + 2:]
-                                    if print_out:
-                                        print(f"Expanded {sym} via {epsilon:.2f} to ['V_pl']")
-                                else:
-                                    symbols = symbols[:where + 1] + ["Adv", "V_pl"]
-                                    if print_out:
-                                        print(f"Expanded {sym} via {epsilon:.2f} to ['V_pl']")
-
-
-                    where = symbols.index(sym)
-                    epsilon = random.uniform(0, 1)
-                    if epsilon <= 0.5:
-                        epsilon2 = random.uniform(0, 1)
-                        if epsilon2 < 0.67:
-                            epsilon3 = random.uniform(0, 1)
-                            if epsilon3 < 0.5:
-                                symbols = symbols[:where] + ["Det_sg", "Adj", "N_sg"] + symbols[where + 1:]
-                                if print_out:
-                                    print(f"Expanded {sym} via {epsilon:.2f}, {epsilon2:.2f}, {epsilon3:.2f} to ['Det_sg', 'Adj', 'N_sg']")
-                            else:
-                                symbols = symbols[:where] + ["Det_sg", "N_sg"] + symbols[where + 1:]
-                                if print_out:
-                                    print(f"Expanded {sym} via {epsilon:.2f}, {epsilon2:.2f}, {epsilon3:.2f} to ['Det_sg', 'N_sg']")
-                        else:
-                            symbols = symbols[:where] + ["ProperNoun_sg"] + symbols[where + 1:]
-                            if print_out:
-                                print(f"Expanded {sym} via {epsilon:.2f}, {epsilon2:.2f} to ['ProperNoun_sg']")
-                    elif epsilon > 0.5:
-                        if symbols[where - 1] == "N_pl":
-                            symbols = symbols[:where] + ["Det_pl", "N_pl"] + symbols[where + 1:]
-                            if print_out:
-                                print(f"Expanded {sym} via {epsilon:.2f} to ['Det_pl', 'N_pl']")
-                        else:
-                            symbols = symbols[:where] + ["Det_sg", "N_sg"] + symbols[where + 1:]
-                            if print_out:
-                                print(f"Expanded {sym} via {epsilon:.2f} to ['Det_sg', 'N_sg']")
-
-
-                #### SINGULAR ####
-                if sym == "NP" or sym == "NP_sg" or sym == "VP_sg" or sym == "NPPrime_sg" or sym == "VP_sequence" or sym == "VP_sg" or sym == "RC_sg":
-                    #NP_seq --> NP , then have NP --> NP_sg , then NP_sg --> Det N_sg, then select terminals of "Det" and "N"
-                    where = symbols.index(sym)
-                    epsilon = random.uniform(0, 1)
-                    if sym == "NP" or sym == "NP_sg": # in this case, we just make NP singular
-                        if epsilon < 0.67:
-                            epsilon2 = random.uniform(0, 1)
-                            if epsilon2 < 0.5:
-                                symbols = symbols[:where] + ["Det_sg", "Adj", "N_sg"] + symbols[where + 1:]
-                                if print_out:
-                                    print(f"Expanded {sym} via {epsilon:.2f}, {epsilon2:.2f} to ['Det_sg', 'Adj', 'N_sg']")
-                            else:
-                                symbols = symbols[:where] + ["Det_sg", "N_sg"] + symbols[where + 1:]
-                                if print_out:
-                                    print(f"Expanded {sym} via {epsilon:.2f}, {epsilon2:.2f} to ['Det_sg', 'N_sg']")
-                        else:
-                            symbols = symbols[:where] + ["ProperNoun_sg"] + symbols[where + 1:]
-                            if print_out:
-                                print(f"Expanded {sym} via {epsilon:.2f} to ['ProperNoun_sg']")
-
-                    if sym == "VP_sequence" or  sym == "VP_sg":
-                        symbols = symbols[:where] + ["V_sg"] + symbols[where + 1:]
-                        if print_out:
-                            print(f"Expanded {sym} via {epsilon:.2f} to ['V_sg']")
-
-                    if sym == "PP_conj":
-                        # PP_conj --> Cong PP
-                        symbols = symbols[:where] + ["Conj", "P", "Det_sg", "N_sg"] + symbols[where + 1:]
-                        if print_out:
-                            print(f"Expanded {sym} to ['Conj', 'P', 'Det_sg', 'N_sg']")
-                    
-                    if sym == "NPPrime_sg":
-                        # NPprime_sg --> PP , PP --> P, Det_sg, N_sg
-                        symbols = symbols[:where] + ["P", "Det_sg", "N_sg"] + symbols[where + 1:]
-                        if print_out:
-                            print(f"Expanded {sym} to ['P', 'Det_sg', 'N_sg']")
-                    
-                    if sym == "RC_sg":
-                        symbols = symbols[:where] + ["RelPronoun", "V_sg"] + symbols[where + 1:]
-                        if print_out:
-                            print(f"Expanded {sym} to ['RelPronoun', 'V_sg']")
-        
-
-                ### PLURAL ###
-                if sym == "NP_pl" or sym == "NPPrime_pl" or sym == "VP_pl" or sym == "RC_pl":
-                    where = symbols.index(sym)
-                    if sym == "VP_pl":
-                        # replace sym with "V_pl" or "Adv V_pl"
-                        epsilon = random.uniform(0, 1)
-                        if epsilon < 0.5:
-                            symbols = symbols[:where] + ["Adv", "V_pl"] + symbols[where + 1:]
-                            if print_out:
-                                print(f"Expanded {sym} via {epsilon:.2f} to ['Adv', 'V_pl']")
-                        else: 
-                            symbols = symbols[:where] + ["V_pl"] + symbols[where + 1:]
-                            if print_out:
-                                print(f"Expanded {sym} via {epsilon:.2f} to ['V_pl']")
-
-                    if sym == "NP_pl":
-                        # NP_pl --> Det_pl N_pl or Det_pl Adj N_pl
-                        epsilon = random.uniform(0, 1)
-                        if epsilon < 0.5:
-                            symbols = symbols[:where] + ["Det_pl", "Adj", "N_pl"] + symbols[where + 1:]
-                            if print_out:
-                                print(f"Expanded {sym} via {epsilon:.2f} to ['Det_pl', 'Adj', 'N_pl']")
-                        else:
-                            symbols = symbols[:where] + ["Det_pl", "N_pl"] + symbols[where + 1:]
-                            if print_out:
-                                print(f"Expanded {sym} via {epsilon:.2f} to ['Det_pl', 'N_pl']")
-
-                    if sym == "NPPrime_pl":
-                        # NPprime_pl --> PP , PP --> P, Det_pl, N_pl
-                        symbols = symbols[:where] + ["P", "Det_pl", "N_pl"] + symbols[where + 1:]
-                        if print_out:
-                            print(f"Expanded {sym} to ['P', 'Det_pl', 'N_pl']")
-
-                    if sym == "RC_pl":
-                        symbols = symbols[:where] + ["RelPronoun", "V_pl"] + symbols[where + 1:]
-                        if print_out:
-                            print(f"Expanded {sym} to ['RelPronoun', 'V_pl']")
-    
-                if sym == "PP" or sym == "PP_conj":
-                    where = symbols.index(sym)
-                    if sym == "PP_conj":
-                        epsilon = random.uniform(0, 1)
-                        if epsilon < 0.5:
-                            # PP_conj --> Conj PP , pp --> P Det_pl N_pl
-                            symbols = symbols[:where] + ["Conj", "P", "Det_pl", "N_pl"] + symbols[where + 1:]
-                            if print_out:
-                                print(f"Expanded {sym} to ['Conj', 'P', 'Det_pl', 'N_pl'] due to agreement with previous symbol {symbols[where - 1]}")
-                        else:
-                            # PP_conj --> Cong PP
-                            where = symbols.index(sym)
-                            symbols = symbols[:where] + ["Conj", "P", "Det_sg", "N_sg"] + symbols[where + 1:]
-                            if print_out:
-                                print(f"Expanded {sym} to ['Conj', 'P', 'Det_sg', 'N_sg'] due to agreement with previous symbol {symbols[where - 1]}")
-                    if sym == "PP":
-                        epsilon = random.uniform(0, 1)
-                        if epsilon < 0.5:
-                            # PP --> P Det N_sg
-                            symbols = symbols[:where] + ["P", "Det_pl", "N_pl"] + symbols[where + 1:]
-                            if print_out:
-                                print(f"Expanded {sym} to ['P', 'Det_pl', 'N_pl'] due to agreement with previous symbol {symbols[where - 1]}")
-                        else:
-                            # PP --> P Det N_pl
-                            symbols = symbols[:where] + ["P", "Det_sg", "N_sg"] + symbols[where + 1:]
-                            if print_out:
-                                print(f"Expanded {sym} to ['P', 'Det_sg', 'N_sg'] due to agreement with previous symbol {symbols[where - 1]}")
-
-        
-        non_lex = any(sym not in lexicon for sym in symbols)
-        if print_out:
-            print("\nSymbols: ", symbols)
-            print("\nNon lexicon: ", non_lex)
-    return symbols
+        tracer = PrintTracer(grammar, tracer)
+    kind = grammar.kind
+    output = []
+    for i, sym in enumerate(symbols):
+        if tracer is not None:
+            stack = [(sym, None)]
+            while stack:
+                sym, parent = stack.pop()
+                if parent is not None:
+                    node = tracer.node(parent, sym)
+                else:
+                    node = nodes[i] if nodes is not None else tracer.node(-1, sym)
+                if not kind[sym] & NONTERMINAL:
+                    output.append(sym)
+                    continue
+                prod = grammar.forced_choice(sym, rng)
+                tracer.expand(node, sym, prod)
+                stack.extend((child, node) for child in reversed(grammar.expansion(prod)))
+            continue
+        stack = [sym]
+        while stack:
+            sym = stack.pop()
+            if not kind[sym] & NONTERMINAL:
+                output.append(sym)
+                continue
+            stack.extend(reversed(grammar.expansion(grammar.forced_choice(sym, rng))))
+    return output
@@ -0,0 +1,91 @@
+'''
+Generation counters, kept per grammar (CompiledGrammar.counters)
+
+An export can be slow for different reasons: most sentences fall outside the length window, derivations keep running
+into the expansion budget or the depth limit and get forced to terminals, or the generator raises and the attempt is
+swallowed by the export's try/except. The counters tell these apart:
+
+    attempts / accepted     sentences generated and sentences written
+    rejections              rejected attempts by reason ("too short", "too long", "duplicate", "error")
+    forced                  forced terminal expansions by cause ("expansion count", "recursion depth"), counted by derive
+    exceptions              exceptions swallowed by the export loops, by type
+    phase_seconds           time spent per phase of the export ("generate", "dedup", "write")
+
+They are plain ints and Counters updated in place (derive only touches them on its forced path), so they stay on.
+as_dict() gives a JSON-ready snapshot; the exports reset the counters of a tier when they start it and dump them at
+the end.
+'''
+
+import json
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+class GenerationCounters:
+    '''
+    Counters of the sentences generated from one grammar.
+    '''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.attempts = 0
+        self.accepted = 0
+        self.rejections = Counter()
+        self.forced = Counter()
+        self.exceptions = Counter()
+        self.phase_seconds = Counter()
+
+    def reject(self, reason):
+        self.rejections[reason] += 1
+
+    def reject_length(self, length, min_length, max_length):
+        '''
+        Counts a rejection by the length window if `length` is outside it; returns True if the sentence is rejected.
+        '''
+        if length < min_length:
+            self.rejections["too short"] += 1
+            return True
+        if length > max_length:
+            self.rejections["too long"] += 1
+            return True
+        return False
+
+    def exception(self, e):
+        self.exceptions[type(e).__name__] += 1
+        self.rejections["error"] += 1
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phase_seconds[name] += time.perf_counter() - start
+
+    def as_dict(self):
+        return {
+            "attempts": self.attempts,
+            "accepted": self.accepted,
+            "rejections": dict(self.rejections),
+            "forced": dict(self.forced),
+            "exceptions": dict(self.exceptions),
+            "phase_seconds": dict(self.phase_seconds),
+        }
+
+    def merge(self, counters):
+        '''
+        Adds a snapshot (as_dict() of another process's counters) to these counters.
+        '''
+        self.attempts += counters["attempts"]
+        self.accepted += counters["accepted"]
+        self.rejections.update(counters["rejections"])
+        self.forced.update(counters["forced"])
+        self.exceptions.update(counters["exceptions"])
+        self.phase_seconds.update(counters["phase_seconds"])
+
+
+def dump_counters(tier, counters):
+    print(f"{tier} counters: {json.dumps(counters.as_dict())}")
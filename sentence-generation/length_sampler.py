@@ -0,0 +1,264 @@
+'''
+Length-conditioned sampling from a CompiledGrammar (no rejection loop)
+
+main_export_lists used to derive sentences with the expansion budgets and throw away everything outside the 11-20
+token window. A LengthSampler instead precomputes, for every symbol and every length up to max_length, how much of
+the grammar's derivations of that symbol have exactly that many tokens, and then draws a derivation of the requested
+length top-down: a production is picked in proportion to its share of the length, and the length is split over the
+right-hand side from left to right in the same way. Every draw has the requested length.
+
+Derivations are weighted by the probability the generators give them (each production of a symbol is equally likely,
+as with random.choice), so conditioning on length keeps their production preferences. They are not subject to
+the expansion budgets (max_expansion_per_symbol, max_recursion_depth) and forced terminal expansion of the
+generators, which change the mix of lengths the rejection loop keeps: over 11-20 tokens the budgeted IX loop gives
+each length roughly 0.09-0.11 of the corpus, while the sampler's share falls from about 0.15 at 11 tokens to 0.07 at
+20 (CS is skewed the other way). Sampling by length is therefore a different corpus distribution, and the exports
+only use it when asked to (exact_length=True). Probabilities rather than raw
+derivation counts are needed because ix_rules contains unit and nullable cycles (VP_pl -> VP_pl, NP_conj_sg -> [])
+under which the number of derivations of a given length is infinite; the tables for one length are the fixpoint of
+those cycles.
+
+Productions are read with CompiledGrammar.resolved_expansion, so S -> NP_sequence VP_placeholder in cs_rules is
+rewritten to the context symbol as generate_sentence_recursion_limits does, and the number agreement of the
+context-sensitive tier is preserved.
+'''
+
+import random
+
+from compiled_grammar import NONTERMINAL
+
+
+class LengthSampler:
+    '''
+    Samples derivations of an exact length (or of a length range) from a compiled grammar.
+
+    The tables are indexed by cell = n * width + d: n tokens and d uses of a counted production. A LengthSampler counts
+    nothing (width 1, d always 0, so the cell is the length); DependencySampler (dependency_sampler.py) overrides
+    max_count and _production_count to add the second dimension. Cells add up like (n, d) pairs as long as no count
+    exceeds max_count, so the split of a cell over a right-hand side is a split of the index.
+    '''
+
+    max_count = 0
+
+    def __init__(self, grammar, max_length, tolerance=1e-12, max_iterations=10000):
+        self.grammar = grammar
+        self.max_length = max_length
+        self.width = self.max_count + 1
+        cells = (max_length + 1) * self.width
+
+        self.rhs = []
+        self.prod_weight = []
+        self.prod_count = []
+        for prod, lhs in enumerate(grammar.prod_lhs):
+            self.rhs.append(grammar.resolved_expansion(prod))
+            self.prod_weight.append(1.0 / len(grammar.productions(lhs)))
+            self.prod_count.append(self._production_count(lhs))
+
+        # inside[sym][cell]: weight of the derivations of sym with exactly n tokens (and d counted productions)
+        self.inside = [[0.0] * cells for _ in range(len(grammar))]
+        for sym in range(len(grammar)):
+            if not grammar.kind[sym] & NONTERMINAL:
+                if max_length >= 1:
+                    self.inside[sym][self.cell(1, 0)] = 1.0
+
+        # suffix[prod][i][cell]: the same for rhs[i:] of prod
+        self.suffix = []
+        for rhs in self.rhs:
+            tables = [[0.0] * cells for _ in range(len(rhs) + 1)]
+            tables[len(rhs)][0] = 1.0
+            self.suffix.append(tables)
+
+        for n in range(max_length + 1):
+            for d in range(self.max_count + 1):
+                self._solve(n, d, tolerance, max_iterations)
+
+        self._production_tables = {}
+        self._split_tables = {}
+        self._length_tables = {}
+
+    def _production_count(self, lhs):
+        '''
+        Number of counted productions a production of `lhs` adds (none in a LengthSampler).
+        '''
+        return 0
+
+    def cell(self, n, d):
+        return n * self.width + d
+
+    def _parts(self, c):
+        '''
+        Cells a first part of cell c can take: every (l, e) with l <= n and e <= d.
+        '''
+        n, d = divmod(c, self.width)
+        return [self.cell(l, e) for l in range(n + 1) for e in range(d + 1)]
+
+    def _solve(self, n, d, tolerance, max_iterations):
+        '''
+        Fills in the tables for length n (and count d). Lengths below n, and smaller counts of length n, are final; a
+        length-n value only depends on other length-n values through unit and nullable productions, so those are
+        iterated to their fixpoint.
+        '''
+        grammar = self.grammar
+        nonterminals = [sym for sym in range(len(grammar)) if grammar.kind[sym] & NONTERMINAL]
+        c = self.cell(n, d)
+        parts = self._parts(c)
+        for _ in range(max_iterations):
+            for prod, rhs in enumerate(self.rhs):
+                tables = self.suffix[prod]
+                for i in range(len(rhs) - 1, -1, -1):
+                    inside = self.inside[rhs[i]]
+                    rest = tables[i + 1]
+                    tables[i][c] = sum(inside[k] * rest[c - k] for k in parts)
+
+            converged = True
+            for sym in nonterminals:
+                value = sum(self.prod_weight[prod] * self.suffix[prod][0][c - self.prod_count[prod]]
+                            for prod in grammar.productions(sym) if self.prod_count[prod] <= d)
+                if abs(value - self.inside[sym][c]) > tolerance * value:
+                    converged = False
+                self.inside[sym][c] = value
+            if converged:
+                return
+
+    def length_weights(self, sym=None):
+        '''
+        Weight of the derivations of `sym` (default: the start symbol) per length 0..max_length (with at most
+        max_count counted productions).
+        '''
+        if sym is None:
+            sym = self.grammar.start
+        inside = self.inside[sym]
+        return [sum(inside[self.cell(n, 0):self.cell(n + 1, 0)]) for n in range(self.max_length + 1)]
+
+    def _choose_production(self, sym, c, rng):
+        key = (sym, c)
+        if key not in self._production_tables:
+            d = c % self.width
+            prods, cum_weights, total = [], [], 0.0
+            for prod in self.grammar.productions(sym):
+                if self.prod_count[prod] > d:
+                    continue
+                weight = self.prod_weight[prod] * self.suffix[prod][0][c - self.prod_count[prod]]
+                if weight > 0:
+                    total += weight
+                    prods.append(prod)
+                    cum_weights.append(total)
+            self._production_tables[key] = (prods, cum_weights)
+        prods, cum_weights = self._production_tables[key]
+        return rng.choices(prods, cum_weights=cum_weights)[0]
+
+    def _choose_split(self, prod, i, c, rng):
+        '''
+        Cell (out of c) derived by rhs[i] of prod, given that rhs[i:] derives cell c.
+        '''
+        key = (prod, i, c)
+        if key not in self._split_tables:
+            inside = self.inside[self.rhs[prod][i]]
+            rest = self.suffix[prod][i + 1]
+            parts, cum_weights, total = [], [], 0.0
+            for k in self._parts(c):
+                weight = inside[k] * rest[c - k]
+                if weight > 0:
+                    total += weight
+                    parts.append(k)
+                    cum_weights.append(total)
+            self._split_tables[key] = (parts, cum_weights)
+        parts, cum_weights = self._split_tables[key]
+        return rng.choices(parts, cum_weights=cum_weights)[0]
+
+    def _split(self, prod, c, rng):
+        '''
+        Cells of the right-hand side symbols of `prod` in a derivation of cell c (below the production itself).
+        '''
+        parts = []
+        for i in range(len(self.rhs[prod]) - 1):
+            k = self._choose_split(prod, i, c, rng)
+            parts.append(k)
+            c -= k
+        parts.append(c)
+        return parts
+
+    def _sample(self, c, rng, tracer):
+        '''
+        Symbol ids of one derivation of the start symbol in cell c.
+        '''
+        kind = self.grammar.kind
+        prod_count = self.prod_count
+        output = []
+        if tracer is not None:
+            tracer.begin()
+            stack = [(self.grammar.start, c, -1)]
+            while stack:
+                sym, c, parent = stack.pop()
+                node = tracer.node(parent, sym)
+                if not kind[sym] & NONTERMINAL:
+                    output.append(sym)
+                    continue
+                prod = self._choose_production(sym, c, rng)
+                tracer.expand(node, sym, prod)
+                rhs = self.rhs[prod]
+                parts = self._split(prod, c - prod_count[prod], rng)
+                for i in range(len(rhs) - 1, -1, -1):
+                    stack.append((rhs[i], parts[i], node))
+            return output
+
+        stack = [(self.grammar.start, c)]
+        while stack:
+            sym, c = stack.pop()
+            if not kind[sym] & NONTERMINAL:
+                output.append(sym)
+                continue
+            prod = self._choose_production(sym, c, rng)
+            rhs = self.rhs[prod]
+            parts = self._split(prod, c - prod_count[prod], rng)
+            for i in range(len(rhs) - 1, -1, -1):
+                stack.append((rhs[i], parts[i]))
+        return output
+
+    def _range_table(self, min_length, max_length, d):
+        '''
+        (lengths, cumulative weights) of the start symbol's lengths in [min_length, max_length] at count d.
+        '''
+        key = (min_length, max_length, d)
+        if key not in self._length_tables:
+            lengths, cum_weights, total = [], [], 0.0
+            for n in range(min_length, min(max_length, self.max_length) + 1):
+                weight = self.inside[self.grammar.start][self.cell(n, d)] if d <= self.max_count else 0
+                if weight > 0:
+                    total += weight
+                    lengths.append(n)
+                    cum_weights.append(total)
+            self._length_tables[key] = (lengths, cum_weights)
+        return self._length_tables[key]
+
+    def sample(self, length, rng=random, tracer=None):
+        '''
+        Returns the preterminal (and terminal) symbol ids of one derivation of exactly `length` tokens.
+
+        A tracer (derivation_trace.py) is given every node and production of the derivation.
+        '''
+        if not 0 <= length <= self.max_length:
+            raise ValueError(f"length {length} is outside 0..{self.max_length} of this sampler")
+        if self.inside[self.grammar.start][self.cell(length, 0)] == 0:
+            raise ValueError(f"the grammar derives no sentence of length {length}")
+        return self._sample(self.cell(length, 0), rng, tracer)
+
+    def sample_range(self, min_length, max_length, rng=random, tracer=None):
+        '''
+        Returns the symbol ids of one derivation whose length lies in [min_length, max_length], with the length drawn
+        in proportion to the grammar's weight at each length. That is the length mix of the unbudgeted grammar, not
+        that of the generators' rejection loop (see the module docstring).
+        '''
+        lengths, cum_weights = self._range_table(min_length, max_length, 0)
+        if not lengths:
+            raise ValueError(f"the grammar derives no sentence of length {min_length}..{max_length}")
+        return self.sample(rng.choices(lengths, cum_weights=cum_weights)[0], rng, tracer)
+
+    def generate(self, min_length, max_length=None, rng=random, tracer=None):
+        '''
+        Returns a lexicalised sentence (list of words) with a length in [min_length, max_length] (exactly min_length
+        if max_length is not given).
+        '''
+        if max_length is None:
+            max_length = min_length
+        return self.grammar.lexicalise(self.sample_range(min_length, max_length, rng, tracer), rng)
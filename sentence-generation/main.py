@@ -13,13 +13,19 @@ import random
 import sys
 import time
 import os
+import multiprocessing
 
 from generate_sentences import generate_sentence, generate_sentence_recursion_limits, generate_sentence_noncf, generate_sentence_fsm
+from compiled_grammar import CompiledGrammar
+from length_sampler import LengthSampler
+from dependency_sampler import DependencySampler
+from sentence_stream import format_sentence, sentence_record, write_jsonl
+from dedup import make_deduplicator, report_duplicate_rate
+from derivation_trace import TreeTracer, TreeWriter
+from generation_counters import dump_counters
+from export_checkpoint import ExportCheckpoint
 # from generate_sentences import generate_sentence_recursion_limits, generate_sentence_noncf
 
-# Increase recursion limit (ONLY if needed)
-# sys.setrecursionlimit(2000)  # really try not to do this
-
 # random.seed(1)
 
 
@@ -218,6 +224,12 @@ lexicon = {
         "RelPronoun": ["who", "which", "that"],
     }
 
+# compiled once (symbols interned to ints, productions as flat arrays) and shared by every generated sentence
+fms_grammar = CompiledGrammar(fms_rules, lexicon)
+cf_grammar = CompiledGrammar(cf_rules, lexicon)
+ix_grammar = CompiledGrammar(ix_rules, lexicon)
+cs_grammar = CompiledGrammar(cs_rules, lexicon)
+
 # ================================================================================================
 # Exmples & Creation Functions
 
@@ -233,14 +245,14 @@ def main_example(print_traversal=False):
     print(sentence_str + ".\n")
 
     print("=== Context-Free Grammar (CFG) Sentence ===")
-    cf_sentence = generate_sentence(cf_rules, lexicon, max_expansion_per_symbol=10, max_recursion_depth=4, print_out=print_traversal)
+    cf_sentence = generate_sentence(cf_grammar, lexicon, max_expansion_per_symbol=10, max_recursion_depth=4, print_out=print_traversal)
     sentence_str = ' '.join(cf_sentence)
     sentence_str = sentence_str[0].upper() + sentence_str[1:]
     print(sentence_str + ".\n")
 
 
     print("\n=== Indexed Grammar (IXG) Sentence ===")
-    ix_sentence = generate_sentence_noncf(ix_rules, lexicon, max_expansion_per_symbol=10, max_recursion_depth=4, print_out=print_traversal)  # limit to better represent English-like sentences
+    ix_sentence = generate_sentence_noncf(ix_grammar, lexicon, max_expansion_per_symbol=10, max_recursion_depth=4, print_out=print_traversal)  # limit to better represent English-like sentences
     sentence_str = ' '.join(ix_sentence)
     sentence_str = sentence_str[0].upper() + sentence_str[1:]
     print(sentence_str + ".\n")
@@ -248,7 +260,7 @@ def main_example(print_traversal=False):
 
     print("\n=== Context-Sensitive Grammar (CSG) Sentence ===")
     try:
-        cs_sentence = generate_sentence_recursion_limits(cs_rules, lexicon, max_expansion_per_symbol=10, max_recursion_depth=4, print_out=print_traversal)
+        cs_sentence = generate_sentence_recursion_limits(cs_grammar, lexicon, max_expansion_per_symbol=10, max_recursion_depth=4, print_out=print_traversal)
     except Exception as e:
         print(f"Error: {e}")
     # check is there are any rules in the sentence, if so, then replace them with terminals
@@ -263,47 +275,340 @@ def main_example(print_traversal=False):
     print(sentence_str + ".\n")
 
  
-def main_export_lists(n, path = ''):
-    cf_cnt, mini_ix_cnt, ix_cnt, cs_cnt = 0, 0, 0, 0
-
-    with open("sentence_lists/cf_sentences.txt", "w") as cf_file:
-        while cf_cnt < n:
-            print(f"\n\n\nGenerating CF sentence {cf_cnt+1}...")
-            cf_sentence = generate_sentence(cf_rules, lexicon, max_expansion_per_symbol=20, max_recursion_depth=10, print_out=False)
-            if cf_sentence is not None and len(cf_sentence) > 10 and len(cf_sentence) < 21: # limit to better represent English-like sentences
-                sentence_str = ' '.join(cf_sentence)
-                sentence_str = sentence_str[0].upper() + sentence_str[1:]
-                cf_file.write(sentence_str + ".\n")
-                cf_cnt += 1
-
-    with open("sentence_lists/ix_sentences.txt", "w") as ix_file:
-        while ix_cnt < n:
-            try:
-                print(f"\n\n\nGenerating IX sentence {ix_cnt+1}...")
-                ix_sentence = generate_sentence_noncf(ix_rules, lexicon, max_expansion_per_symbol=20, max_recursion_depth=10, print_out=False)
-            except Exception as e:
-                print(f"Error: {e}")
-            if ix_sentence is not None and len(ix_sentence) > 10 and len(ix_sentence) < 21: # limit to better represent English-like sentences
-                # check if there are at least 3 instances of any of these words "that, "which, "who" -- this is uncommented if this amount of dependencies is wanted
-                # if ix_sentence.count("that") + ix_sentence.count("which") + ix_sentence.count("who") > 3:
-                    sentence_str = ' '.join(ix_sentence)
-                    sentence_str = sentence_str[0].upper() + sentence_str[1:]
-                    ix_file.write(sentence_str + ".\n")
-                    ix_cnt += 1
-
-    with open("sentence_lists/cs_sentences.txt", "w") as cs_file:
-        while cs_cnt < n:
+def report_accept_rate(tier, accepted, attempts):
+    print(f"{tier}: {accepted} sentences accepted out of {attempts} attempts (accept rate {100 * accepted / max(attempts, 1):.1f}%)")
+
+
+def open_sentences(tier, offset=None):
+    '''
+    sentence_lists/{tier}_sentences.txt opened for writing, or, when resuming from a checkpoint, cut back to the
+    checkpointed offset and opened for appending.
+    '''
+    path = f"sentence_lists/{tier}_sentences.txt"
+    if offset is None:
+        return open(path, "w")
+    os.truncate(path, offset)
+    return open(path, "a")
+
+
+def open_trees(tier, grammar, trace, offset=None):
+    '''
+    TreeWriter for sentence_lists/{tier}_trees.bin when tracing (None otherwise), with the file it writes to; with an
+    offset, the file is cut back to it and appended to, as for open_sentences.
+    '''
+    if not trace:
+        return None, None
+    path = f"sentence_lists/{tier}_trees.bin"
+    if offset is None:
+        file = open(path, "wb")
+        return file, TreeWriter(file, grammar)
+    os.truncate(path, offset)
+    file = open(path, "ab")
+    return file, TreeWriter(file, grammar, header=False)
+
+
+# generator and compiled grammar of each tier, as used by the exports
+tiers = {
+    "cf": (generate_sentence, cf_grammar),
+    "ix": (generate_sentence_noncf, ix_grammar),
+    "cs": (generate_sentence_recursion_limits, cs_grammar),
+}
+
+
+def main_export_lists(n, path = '', min_length=11, max_length=20, exact_length=False, dedup=False, false_positive_rate=1e-4, trace=False,
+                      seed=None, checkpoint=None, checkpoint_every=100000):
+    '''
+    Writes n sentences of min_length..max_length tokens per grammar to sentence_lists/.
+
+    By default sentences are generated with the expansion budgets and the ones outside the window are rejected.
+    With exact_length, they are drawn directly at a length in the window by a LengthSampler (nothing is rejected),
+    which is faster but changes the mix of lengths (and so the corpus; see length_sampler.py).
+    With dedup, repeated sentences are dropped too (see dedup.py; false_positive_rate applies to runs large enough to
+    use a Bloom filter) and the duplicate rate of each tier is reported.
+    With trace, the derivation tree of every written sentence is stored in the same order in sentence_lists/{tier}_trees.bin
+    (see derivation_trace.py).
+    With seed, the `random` module is seeded first. With checkpoint (a file path), progress is saved every
+    checkpoint_every sentences, and a run with the same arguments after an interruption resumes from it, skipping the
+    tiers already complete, with the same output as an uninterrupted run (see export_checkpoint.py).
+    Returns the generation counters of each tier (see generation_counters.py), which are also printed at the end.
+    '''
+    tracer = TreeTracer() if trace else None
+    settings = {"export": "sequential", "n": n, "min_length": min_length, "max_length": max_length, "exact_length": exact_length,
+                "dedup": dedup, "false_positive_rate": false_positive_rate, "trace": trace, "seed": seed}
+    progress = ExportCheckpoint(checkpoint, settings, checkpoint_every)
+    if progress.resuming:
+        random.setstate(progress.rng_state)
+    elif seed is not None:
+        random.seed(seed)
+
+    for tier, (generator, grammar) in tiers.items():
+        counters = grammar.counters
+        state = progress.resume(tier, counters)
+        if progress.complete(tier):
+            print(f"{tier.upper()}: complete in {checkpoint}, skipped")
+            continue
+        if exact_length:
+            with counters.phase("setup"):
+                sampler = LengthSampler(grammar, max_length)
+        if state is None:
+            cnt = 0
+            deduplicator = make_deduplicator(n, false_positive_rate) if dedup else None
+            trees_file, trees = open_trees(tier, grammar, trace)
+            file = open_sentences(tier)
+        else:
+            cnt = state["count"]
+            deduplicator = state["deduplicator"]
+            trees_file, trees = open_trees(tier, grammar, trace, state["trees_offset"])
+            file = open_sentences(tier, state["offset"])
+        with file:
+            while cnt < n:
+                if exact_length:
+                    counters.attempts += 1
+                    with counters.phase("generate"):
+                        sentence = sampler.generate(min_length, max_length, tracer=tracer)
+                else:
+                    try:
+                        print(f"\n\n\nGenerating {tier.upper()} sentence {cnt+1}...")
+                        counters.attempts += 1
+                        with counters.phase("generate"):
+                            sentence = generator(grammar, lexicon, max_expansion_per_symbol=20, max_recursion_depth=10, print_out=False, tracer=tracer)
+                    except Exception as e:
+                        print(f"Error: {e}")
+                        counters.exception(e)
+                        continue
+                    # limit to better represent English-like sentences
+                    # (main_export_graded draws IX/CS sentences with a given number of dependencies directly, rather than filtering here)
+                    if sentence is None or counters.reject_length(len(sentence), min_length, max_length):
+                        continue
+                sentence_str = format_sentence(sentence)
+                if deduplicator is not None:
+                    with counters.phase("dedup"):
+                        if not deduplicator.add(sentence_str):
+                            counters.reject("duplicate")
+                            continue
+                with counters.phase("write"):
+                    file.write(sentence_str + "\n")
+                    if trees is not None:
+                        trees.write(tracer.tree)
+                counters.accepted += 1
+                cnt += 1
+                if progress.due(cnt):
+                    progress.save(tier, cnt, file, trees_file, deduplicator, counters)
+            progress.save(tier, cnt, file, trees_file, deduplicator, counters, complete=True)
+        if trees_file is not None:
+            trees_file.close()
+        report_accept_rate(tier.upper(), cnt, counters.attempts)
+        if deduplicator is not None:
+            report_duplicate_rate(tier.upper(), deduplicator)
+
+    for tier, (_, grammar) in tiers.items():
+        dump_counters(tier.upper(), grammar.counters)
+    return {tier: grammar.counters.as_dict() for tier, (_, grammar) in tiers.items()}
+
+
+def main_export_jsonl(n, seed=1, min_length=11, max_length=20, exact_length=False, dedup=False, false_positive_rate=1e-4):
+    '''
+    Writes n sentences per grammar to sentence_lists/{tier}_sentences.jsonl, one JSON record per line with the id (1..n),
+    tier, text, token length, derivation depth, whether forced terminal expansion was used, and seed
+    (see sentence_stream.py).
+
+    Each attempt draws from its own random.Random, seeded from a master random.Random(seed), and the seed of the
+    attempt is the record's seed, so any one sentence can be derived again from its record alone:
+    LengthSampler(grammar, max_length).generate(min_length, max_length, random.Random(seed)) with exact_length, and
+    generator(grammar, lexicon, max_expansion_per_symbol=20, max_recursion_depth=10, rng=random.Random(seed)) otherwise.
+    Returns the generation counters of each tier.
+    '''
+    tracer = TreeTracer()
+    master = random.Random(seed)
+    for tier, (generator, grammar) in tiers.items():
+        counters = grammar.counters
+        counters.reset()
+        if exact_length:
+            with counters.phase("setup"):
+                sampler = LengthSampler(grammar, max_length)
+        deduplicator = make_deduplicator(n, false_positive_rate) if dedup else None
+
+        def records():
+            cnt = 0
+            while cnt < n:
+                counters.attempts += 1
+                sentence_seed = master.getrandbits(64)
+                rng = random.Random(sentence_seed)
+                try:
+                    with counters.phase("generate"):
+                        if exact_length:
+                            sentence = sampler.generate(min_length, max_length, rng, tracer)
+                        else:
+                            sentence = generator(grammar, lexicon, max_expansion_per_symbol=20, max_recursion_depth=10, print_out=False, rng=rng, tracer=tracer)
+                except Exception as e:
+                    print(f"Error: {e}")
+                    counters.exception(e)
+                    continue
+                if counters.reject_length(len(sentence), min_length, max_length):
+                    continue
+                record = sentence_record(cnt + 1, tier, sentence, tracer.tree, sentence_seed)
+                if deduplicator is not None:
+                    with counters.phase("dedup"):
+                        if not deduplicator.add(record["text"]):
+                            counters.reject("duplicate")
+                            continue
+                counters.accepted += 1
+                cnt += 1
+                yield record
+
+        with open(f"sentence_lists/{tier}_sentences.jsonl", "w", buffering=1 << 20) as file:
+            written = write_jsonl(records(), file)
+        report_accept_rate(tier.upper(), written, counters.attempts)
+        if deduplicator is not None:
+            report_duplicate_rate(tier.upper(), deduplicator)
+    for tier, (_, grammar) in tiers.items():
+        dump_counters(tier.upper(), grammar.counters)
+    return {tier: grammar.counters.as_dict() for tier, (_, grammar) in tiers.items()}
+
+
+# symbols whose productions are counted as dependencies: relative clauses (nested) in IX, the NP_sequence productions
+# in CS. The context production adds a leading NP_sg / NP_pl that always pairs with its VP_sg / VP_pl, and each counted
+# production one more noun phrase that pairs with a verb phrase only where VP_sequence produces one (it may be empty),
+# so a CS count of k means k + 1 noun phrases and at least 1, at most k + 1 cross-serial NP/VP pairs
+dependency_symbols = {
+    "ix": ("RC_sg", "RC_pl"),
+    "cs": ("NP_sequence",),
+}
+
+
+def main_export_graded(n, counts=(1, 2, 3, 4, 5), min_length=11, max_length=20, seed=1):
+    '''
+    Writes difficulty-graded lists: n sentences of min_length..max_length tokens per tier of dependency_symbols and per
+    number of dependencies in counts, to sentence_lists/{tier}_dep{count}_sentences.txt. Sentences are drawn by a
+    DependencySampler with exactly that many dependencies (nothing is rejected); the share of the grammar's derivations
+    a filter on the count would keep (DependencySampler.count_distribution) is reported alongside.
+    '''
+    rng = random.Random(seed)
+    for tier, counted in dependency_symbols.items():
+        grammar = tiers[tier][1]
+        sampler = DependencySampler(grammar, max_length, counted, max(counts))
+        shares = sampler.count_distribution(min_length, max_length)
+        for count in counts:
+            with open(f"sentence_lists/{tier}_dep{count}_sentences.txt", "w") as file:
+                for _ in range(n):
+                    file.write(format_sentence(sampler.generate(min_length, max_length, count, rng)) + "\n")
+            print(f"{tier.upper()}, {count} dependencies: {n} sentences (a filter on the count would keep {100 * shares[count]:.3g}% of the grammar's derivations)")
+
+
+length_samplers = {}  # per process, (tier, max_length) -> LengthSampler
+
+
+def shard_seed(seed, tier, shard):
+    '''
+    Seed of the RNG stream of one shard, derived from the master seed (independent of the process that runs the shard).
+    '''
+    return random.Random(f"{seed}:{tier}:{shard}").getrandbits(64)
+
+
+def export_shard(shard):
+    '''
+    Generates one shard of a tier in a worker process; returns the shard's text and the shard's generation counters.
+    '''
+    tier, count, seed, min_length, max_length, exact_length = shard
+    generator, grammar = tiers[tier]
+    counters = grammar.counters
+    counters.reset()
+    rng = random.Random(seed)
+
+    lines = []
+    if exact_length:
+        if (tier, max_length) not in length_samplers:
+            with counters.phase("setup"):
+                length_samplers[(tier, max_length)] = LengthSampler(grammar, max_length)
+        sampler = length_samplers[(tier, max_length)]
+        with counters.phase("generate"):
+            for _ in range(count):
+                lines.append(format_sentence(sampler.generate(min_length, max_length, rng)) + "\n")
+        counters.attempts = count
+    else:
+        while len(lines) < count:
+            counters.attempts += 1
             try:
-                print(f"\n\n\nGenerating CS sentence {cs_cnt+1}...")
-                # run with python -u to see print dispite recursion limits (python -u current-new-sentences.py)
-                cs_sentence = generate_sentence_recursion_limits(cs_rules, lexicon, max_expansion_per_symbol=20, max_recursion_depth=10, print_out=False)
+                with counters.phase("generate"):
+                    sentence = generator(grammar, lexicon, max_expansion_per_symbol=20, max_recursion_depth=10, print_out=False, rng=rng)
             except Exception as e:
                 print(f"Error: {e}")
-            if cs_sentence is not None and len(cs_sentence) > 10 and len(cs_sentence) < 21: # limit to the length of the other sentences
-                sentence_str = ' '.join(cs_sentence)
-                sentence_str = sentence_str[0].upper() + sentence_str[1:]
-                cs_file.write(sentence_str + ".\n")
-                cs_cnt += 1
+                counters.exception(e)
+                continue
+            if not counters.reject_length(len(sentence), min_length, max_length):
+                lines.append(format_sentence(sentence) + "\n")
+    counters.accepted = len(lines)
+    return "".join(lines), counters.as_dict()
+
+
+def main_export_lists_parallel(n, workers=None, seed=1, shard_size=10000, min_length=11, max_length=20, exact_length=False,
+                               dedup=False, false_positive_rate=1e-4, checkpoint=None, checkpoint_every=100000):
+    '''
+    Same output files as main_export_lists, generated over a process pool.
+
+    Each tier is cut into shards of shard_size sentences and every shard draws from its own random.Random seeded from
+    (seed, tier, shard index). Shards are written back in order, so the files are byte-identical for the same master
+    seed, whatever the number of workers. With dedup, duplicates are dropped in the parent process (so across shards)
+    and further shards are generated until n sentences are written.
+    The counters of the shards are merged per tier, printed at the end and returned.
+    With checkpoint, progress is saved after the first shard past every checkpoint_every sentences and an interrupted
+    run resumes from it, as for main_export_lists (the number of workers may differ).
+    '''
+    settings = {"export": "parallel", "n": n, "seed": seed, "shard_size": shard_size, "min_length": min_length, "max_length": max_length,
+                "exact_length": exact_length, "dedup": dedup, "false_positive_rate": false_positive_rate}
+    progress = ExportCheckpoint(checkpoint, settings, checkpoint_every)
+    with multiprocessing.Pool(workers) as pool:
+        for tier in tiers:
+            counters = tiers[tier][1].counters
+            state = progress.resume(tier, counters)
+            if progress.complete(tier):
+                print(f"{tier.upper()}: complete in {checkpoint}, skipped")
+                continue
+            if state is None:
+                deduplicator = make_deduplicator(n, false_positive_rate) if dedup else None
+                written, shard, pending = 0, 0, []
+                file = open_sentences(tier)
+            else:
+                deduplicator = state["deduplicator"]
+                written, shard, pending = state["count"], state["shard"], state["pending"]
+                file = open_sentences(tier, state["offset"])
+            with file:
+                while written < n:
+                    # pending: the shards of the current batch not written yet
+                    if not pending:
+                        for start in range(0, n - written, shard_size):
+                            pending.append((tier, min(shard_size, n - written - start), shard_seed(seed, tier, shard), min_length, max_length, exact_length))
+                            shard += 1
+                    for text, shard_counters in pool.imap(export_shard, list(pending)):
+                        pending.pop(0)
+                        counters.merge(shard_counters)
+                        if deduplicator is None:
+                            with counters.phase("write"):
+                                file.write(text)
+                            written += text.count("\n")
+                        else:
+                            for line in text.splitlines(keepends=True):
+                                if written >= n:
+                                    break
+                                with counters.phase("dedup"):
+                                    new = deduplicator.add(line)
+                                if not new:
+                                    counters.reject("duplicate")
+                                    continue
+                                with counters.phase("write"):
+                                    file.write(line)
+                                written += 1
+                        if progress.due(written):
+                            progress.save(tier, written, file, None, deduplicator, counters, shard=shard, pending=pending)
+                progress.save(tier, written, file, None, deduplicator, counters, complete=True, shard=shard, pending=pending)
+            counters.accepted = written
+            report_accept_rate(tier.upper(), written, counters.attempts)
+            if deduplicator is not None:
+                report_duplicate_rate(tier.upper(), deduplicator)
+        for tier in tiers:
+            dump_counters(tier.upper(), tiers[tier][1].counters)
+    return {tier: tiers[tier][1].counters.as_dict() for tier in tiers}
+
 
 
 if __name__ == "__main__":
@@ -0,0 +1,276 @@
+'''
+Earley recognizer for the context-free tier (cf_rules), to validate generated corpora
+
+Nothing checked that a line of sentence_lists/cf_sentences.txt actually belongs to the cf_rules language (the forced
+terminal expansions used to take shortcuts that the rules do not allow). EarleyRecognizer parses with the same rules
+and lexicon dicts the generators use:
+
+    - words are mapped to their preterminals with a precomputed inverse lexicon (word -> preterminal ids), so a
+      sentence with an unknown word is rejected before any parsing
+    - the chart holds, for every position, the Earley items (production, dot, origin) and an index from symbol to the
+      items waiting for that symbol there, so completing a constituent only visits the items that can use it
+    - nullable symbols (NP_conj_sg -> [] etc.) are handled by advancing over them at prediction (Aycock & Horspool)
+
+    - only productions whose FIRST set meets the categories of the next word (or that are nullable) are predicted
+
+Any grammar in the dict format without context-sensitive left-hand sides can be recognized the same way. ix_rules is
+written as such a grammar (its nested RC_sg/RC_pl agreement is encoded by the _sg/_pl split of the nonterminals), and
+Earley items handle its left-recursive NP_sg -> NP_sg PP, VP_sg -> VP_sg PP and unit VP_pl -> VP_pl productions in
+O(n^3), so the same recognizer checks the IX tier.
+
+    python recognizer.py [cf|ix] [corpus files]   # defaults to the tier's sentence list and test set
+
+Corpus files are streamed in chunks over a process pool, so corpora of millions of sentences validate in bounded
+memory; each sentence's chart is O(n^2) items and is dropped once the sentence is decided.
+'''
+
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from compiled_grammar import NONTERMINAL
+from generate_sentences import compile_grammar
+from sentence_stream import iter_jsonl
+
+
+def read_corpus(path):
+    '''
+    Sentences of a corpus file: one per line for .txt, the "text" fields of {"sentences": [{"id", "text"}]} for .json
+    and of the records of .jsonl.
+    '''
+    if path.endswith(".jsonl"):
+        return [record["text"] for record in iter_jsonl(path)]
+    if path.endswith(".json"):
+        with open(path) as file:
+            return [sentence["text"] for sentence in json.load(file)["sentences"]]
+    with open(path) as file:
+        return [line.rstrip("\n") for line in file if line.strip()]
+
+
+def tokenize(sentence_str):
+    '''
+    Inverse of format_sentence: drops the final period and splits on spaces (capitalisation is handled by the lookup).
+    '''
+    sentence_str = sentence_str.strip()
+    if sentence_str.endswith("."):
+        sentence_str = sentence_str[:-1]
+    return sentence_str.split()
+
+
+class EarleyRecognizer:
+    '''
+    Membership test for the language of a context-free rules dict (or CompiledGrammar) and lexicon.
+    '''
+
+    def __init__(self, rules, lexicon=None):
+        grammar = compile_grammar(rules, lexicon)
+        self.grammar = grammar
+        self.rhs = [tuple(grammar.expansion(prod)) for prod in range(len(grammar.prod_lhs))]
+        self.lhs = list(grammar.prod_lhs)
+        self.is_nonterminal = [bool(grammar.kind[sym] & NONTERMINAL) for sym in range(len(grammar))]
+        self.predictions = [tuple(grammar.productions(sym)) for sym in range(len(grammar))]
+
+        self.nullable = [False] * len(grammar)
+        changed = True
+        while changed:
+            changed = False
+            for prod, rhs in enumerate(self.rhs):
+                if not self.nullable[self.lhs[prod]] and all(self.nullable[sym] for sym in rhs):
+                    self.nullable[self.lhs[prod]] = True
+                    changed = True
+
+        # FIRST sets: the (pre)terminals a production can begin with, to predict only productions the next word can start
+        first = [set() if self.is_nonterminal[sym] else {sym} for sym in range(len(grammar))]
+        changed = True
+        while changed:
+            changed = False
+            for prod, rhs in enumerate(self.rhs):
+                lhs_first = first[self.lhs[prod]]
+                size = len(lhs_first)
+                lhs_first.update(self._sequence_first(rhs, first))
+                changed |= len(lhs_first) != size
+        self.prod_first = [frozenset(self._sequence_first(rhs, first)) for rhs in self.rhs]
+        self.prod_nullable = [all(self.nullable[sym] for sym in rhs) for rhs in self.rhs]
+        self._predict_cache = {}
+
+        # inverse lexicon: word -> preterminals (and terminals written in the rules, which are their own word)
+        self.word_symbols = {}
+        for sym in range(len(grammar)):
+            if not self.is_nonterminal[sym]:
+                for w in grammar.words[grammar.word_offsets[sym]:grammar.word_offsets[sym + 1]]:
+                    self.word_symbols.setdefault(grammar.vocab[w], set()).add(sym)
+
+    def _sequence_first(self, rhs, first):
+        symbols = set()
+        for sym in rhs:
+            symbols |= first[sym]
+            if not self.nullable[sym]:
+                break
+        return symbols
+
+    def lookup(self, word, first=False):
+        symbols = self.word_symbols.get(word, frozenset())
+        if first:
+            # the first word was capitalised by format_sentence
+            symbols = symbols | self.word_symbols.get(word[:1].lower() + word[1:], frozenset())
+        return frozenset(symbols)
+
+    def _predictions(self, sym, next_symbols):
+        '''
+        Productions of `sym` that can start with one of next_symbols (the categories of the next word) or are nullable.
+        '''
+        key = (sym, next_symbols)
+        prods = self._predict_cache.get(key)
+        if prods is None:
+            prods = tuple(prod for prod in self.predictions[sym]
+                          if self.prod_nullable[prod] or not self.prod_first[prod].isdisjoint(next_symbols))
+            self._predict_cache[key] = prods
+        return prods
+
+    def recognizes(self, words):
+        '''
+        True if the list of words is a sentence of the grammar.
+        '''
+        token_symbols = [self.lookup(word, first=(i == 0)) for i, word in enumerate(words)]
+        if not all(token_symbols):
+            return False
+
+        n = len(words)
+        rhs_of, lhs_of = self.rhs, self.lhs
+        is_nonterminal, nullable, predict = self.is_nonterminal, self.nullable, self._predictions
+        start = self.grammar.start
+        token_symbols.append(frozenset())
+
+        items = [set() for _ in range(n + 1)]
+        waiting = [{} for _ in range(n + 1)]  # position -> symbol -> items waiting for it there
+
+        items[0].update((prod, 0, 0) for prod in predict(start, token_symbols[0]))
+        for i in range(n + 1):
+            agenda = list(items[i])
+            chart_i, waiting_i = items[i], waiting[i]
+            next_symbols = token_symbols[i]
+            predicted = set()
+            while agenda:
+                item = agenda.pop()
+                prod, dot, origin = item
+                rhs = rhs_of[prod]
+                if dot < len(rhs):
+                    sym = rhs[dot]
+                    if is_nonterminal[sym]:
+                        waiting_i.setdefault(sym, []).append(item)
+                        if sym not in predicted:
+                            predicted.add(sym)
+                            for p in predict(sym, next_symbols):
+                                new = (p, 0, i)
+                                if new not in chart_i:
+                                    chart_i.add(new)
+                                    agenda.append(new)
+                        if nullable[sym]:
+                            new = (prod, dot + 1, origin)
+                            if new not in chart_i:
+                                chart_i.add(new)
+                                agenda.append(new)
+                    elif sym in next_symbols:
+                        items[i + 1].add((prod, dot + 1, origin))
+                else:
+                    for p, d, o in waiting[origin].get(lhs_of[prod], ()):
+                        new = (p, d + 1, o)
+                        if new not in chart_i:
+                            chart_i.add(new)
+                            agenda.append(new)
+            if i < n and not items[i + 1]:
+                return False
+
+        return any((prod, len(rhs_of[prod]), 0) in items[n] for prod in self.predictions[start])
+
+    def validate(self, sentences):
+        '''
+        Returns the indices of the sentences (strings) that are not in the language.
+        '''
+        return [k for k, sentence_str in enumerate(sentences) if not self.recognizes(tokenize(sentence_str))]
+
+
+recognizers = {}  # per process: tier -> EarleyRecognizer, built on first use (also inside pool workers)
+
+
+def tier_recognizer(tier):
+    if tier not in recognizers:
+        from main import cf_grammar, ix_grammar
+        recognizers[tier] = EarleyRecognizer({"cf": cf_grammar, "ix": ix_grammar}[tier])
+    return recognizers[tier]
+
+
+def iter_corpus_chunks(path, chunk_size):
+    '''
+    Yields (index of the first sentence, sentences) chunks of a corpus file; .txt and .jsonl files are streamed, so
+    memory does not grow with the corpus.
+    '''
+    if path.endswith(".jsonl"):
+        chunk, start = [], 0
+        for record in iter_jsonl(path):
+            chunk.append(record["text"])
+            if len(chunk) == chunk_size:
+                yield start, chunk
+                chunk, start = [], start + chunk_size
+        if chunk:
+            yield start, chunk
+        return
+    if path.endswith(".json"):
+        sentences = read_corpus(path)
+        for start in range(0, len(sentences), chunk_size):
+            yield start, sentences[start:start + chunk_size]
+        return
+    with open(path) as file:
+        chunk, start = [], 0
+        for line in file:
+            if line.strip():
+                chunk.append(line.rstrip("\n"))
+            if len(chunk) == chunk_size:
+                yield start, chunk
+                chunk, start = [], start + chunk_size
+        if chunk:
+            yield start, chunk
+
+
+def validate_chunk(chunk):
+    '''
+    Pool task: (tier, index of the first sentence, sentences) -> (number of sentences, [(index, sentence)] of those not
+    in the language).
+    '''
+    tier, start, sentences = chunk
+    return len(sentences), [(start + k, sentences[k]) for k in tier_recognizer(tier).validate(sentences)]
+
+
+def validate_files(tier, paths, workers=None, chunk_size=10000):
+    '''
+    Validates every corpus file against the cf or ix tier in batch, over `workers` processes (all cores by default), and
+    prints the rejected sentences and the throughput.
+    '''
+    workers = workers or os.cpu_count()
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        for path in paths:
+            start = time.time()
+            total = invalid = 0
+            chunks = ((tier, first, sentences) for first, sentences in iter_corpus_chunks(path, chunk_size))
+            for count, rejected in (pool.imap(validate_chunk, chunks) if pool else map(validate_chunk, chunks)):
+                for k, sentence_str in rejected:
+                    print(f"{path}:{k + 1}: {sentence_str}")
+                total += count
+                invalid += len(rejected)
+            elapsed = time.time() - start
+            print(f"{path}: {total - invalid} of {total} sentences in the {tier} language "
+                  f"({total / max(elapsed, 1e-9):.0f} sentences/s)")
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    tier = args.pop(0) if args[:1] in (["cf"], ["ix"]) else "cf"
+    paths = args or [f"sentence_lists/{tier}_sentences.txt", f"test_sentences/{tier}_sentences.json"]
+    validate_files(tier, paths)
@@ -0,0 +1,128 @@
+'''
+Streaming sentence API: draw sentences lazily instead of exporting a text file first
+
+    from itertools import islice
+    from main import cf_grammar, lexicon
+    from generate_sentences import generate_sentence
+
+    sentences = iter_sentences(cf_grammar, lexicon, filters=[length_filter(11, 20)], seed=1, generator=generate_sentence)
+    for sentence in islice(sentences, 1000):
+        ...
+
+iter_sentences is an infinite generator (take what is needed with itertools.islice), keeps nothing but the RNG and
+the current sentence, and so runs in constant memory however many sentences are drawn. Filters are plain predicates
+on the word list and writers consume any iterable of sentences, so they compose with other itertools pipelines.
+
+Corpora with per-sentence metadata are JSON Lines, one record per line (main_export_jsonl writes them):
+
+    {"id": 1, "tier": "cf", "text": "...", "length": 14, "depth": 9, "forced": false, "seed": 1234}
+
+with the "id" and "text" of the test_sentences/*.json records. iter_jsonl reads them back one line at a time, and
+can split a file into shards by line number without parsing the other shards' lines.
+'''
+
+import json
+import random
+
+from generate_sentences import generate_sentence
+
+
+def iter_sentences(grammar, lexicon, filters=(), seed=None, generator=generate_sentence,
+                   max_expansion_per_symbol=20, max_recursion_depth=10):
+    '''
+    Yields generated sentences (lists of words) that pass every filter, forever.
+
+    `generator` is one of the generators of generate_sentences.py (generate_sentence, generate_sentence_noncf or
+    generate_sentence_recursion_limits, matching the grammar) and draws from a random.Random seeded with `seed`.
+    '''
+    rng = random.Random(seed)
+    while True:
+        try:
+            sentence = generator(grammar, lexicon, max_expansion_per_symbol=max_expansion_per_symbol,
+                                 max_recursion_depth=max_recursion_depth, print_out=False, rng=rng)
+        except Exception as e:
+            print(f"Error: {e}")
+            continue
+        if all(keep(sentence) for keep in filters):
+            yield sentence
+
+
+def iter_sampled_sentences(sampler, min_length, max_length=None, seed=None):
+    '''
+    Yields sentences of min_length..max_length tokens drawn by a LengthSampler, forever.
+    '''
+    rng = random.Random(seed)
+    while True:
+        yield sampler.generate(min_length, max_length, rng)
+
+
+def length_filter(min_length, max_length):
+    '''
+    Keeps sentences of min_length..max_length words (11..20 is the window of main_export_lists).
+    '''
+    def keep(sentence):
+        return min_length <= len(sentence) <= max_length
+    return keep
+
+
+def word_count_filter(words, min_count):
+    '''
+    Keeps sentences with more than min_count occurrences of the given words, e.g. the relative pronouns of the IX tier.
+    '''
+    words = set(words)
+
+    def keep(sentence):
+        return sum(word in words for word in sentence) > min_count
+    return keep
+
+
+def format_sentence(sentence):
+    '''
+    Capitalised, space-joined sentence with a final period (the line format of sentence_lists/).
+    '''
+    sentence_str = ' '.join(sentence)
+    return sentence_str[0].upper() + sentence_str[1:] + "."
+
+
+def sentence_record(id, tier, sentence, tree, seed):
+    '''
+    JSON Lines record of a sentence (list of words) with the metadata of its derivation tree (derivation_trace.py).
+    '''
+    return {"id": id, "tier": tier, "text": format_sentence(sentence), "length": len(sentence), "depth": tree.depth(),
+            "forced": tree.any_forced(), "seed": seed}
+
+
+def write_jsonl(records, file, batch_size=1000):
+    '''
+    Writes records to an open text file as JSON Lines, batch_size lines per write; returns the number written.
+    '''
+    count, lines = 0, []
+    for record in records:
+        lines.append(json.dumps(record) + "\n")
+        count += 1
+        if len(lines) == batch_size:
+            file.write("".join(lines))
+            lines = []
+    file.write("".join(lines))
+    return count
+
+
+def iter_jsonl(path, shard=0, shards=1):
+    '''
+    Yields the records of a JSON Lines file; with shards > 1, only those of lines shard, shard + shards, ...
+    '''
+    with open(path) as file:
+        for index, line in enumerate(file):
+            if index % shards == shard and line.strip():
+                yield json.loads(line)
+
+
+def write_sentences(sentences, file):
+    '''
+    Writes every sentence of an iterable to an open text file, one per line; returns the number written.
+    '''
+    count = 0
+    for sentence in sentences:
+        file.write(format_sentence(sentence) + "\n")
+        count += 1
+    return count
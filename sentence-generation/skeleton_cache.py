@@ -0,0 +1,151 @@
+'''
+Skeleton cache: derive a preterminal skeleton once, lexicalise it many times
+
+Deriving a sentence (the expansion budgets, forced expansions, the length window) costs far more than drawing its
+words, and the words are independent of the derivation. A SkeletonCache derives skeletons such as
+Det_sg Adj N_sg Adv V_sg (generators with lexicalise=False) and turns each into `relexicalisations` sentences:
+
+    relexicalisations   sentences drawn in a row from one skeleton (1 = plain generation)
+    reuse               share of the skeletons that are taken from the cache (uniformly among the cached ones) rather
+                        than derived; 0 derives every skeleton, values near 1 derive almost none once the cache is warm
+    max_reuse           total number of sentences any one distinct skeleton may produce over the run (None = no limit);
+                        a skeleton that has reached it is skipped and another one taken, which bounds how much the
+                        corpus repeats a structure
+    capacity            number of distinct skeletons kept, least recently used evicted first, so memory stays bounded
+                        on long runs
+
+The grammar's counters count every sentence yielded as accepted. The attempts are every derivation attempt (counted by
+skeleton_source), every skeleton taken from the cache, and every relexicalisation after the first sentence of a
+skeleton, so the accept rate is that of the sentences actually produced; skeletons skipped for max_reuse are rejected
+as "max_reuse".
+
+Each cached skeleton is kept with the metadata of its latest derivation (length, tree depth, whether forced terminal
+expansion was used). Sentences from a freshly derived skeleton carry the metadata of that derivation (a skeleton can
+be derived in more than one way, so a repeat replaces the stored metadata); sentences from a cached skeleton carry
+the metadata stored with it.
+
+    cache = SkeletonCache(skeleton_source(generate_sentence, cf_grammar, lexicon, 11, 20), cf_grammar,
+                          relexicalisations=8, reuse=0.9, max_reuse=32)
+    for words, metadata in itertools.islice(cache.iter_sentences(random.Random(1)), 1000):
+        ...
+'''
+
+import random
+from collections import OrderedDict
+
+from derivation_trace import TreeTracer
+
+
+def skeleton_source(generator, grammar, lexicon, min_length, max_length, max_expansion_per_symbol=20,
+                    max_recursion_depth=10, max_attempts=10000, trace=True):
+    '''
+    Returns derive(rng) -> (skeleton, metadata): a skeleton of min_length..max_length symbols from one of the
+    generators of generate_sentences.py (retrying rejected and failed derivations, as the exports do, and counting
+    every try as an attempt).
+    Without trace the metadata only has the length, and derivation skips the tree recording.
+    '''
+    tracer = TreeTracer() if trace else None
+
+    def derive(rng):
+        for _ in range(max_attempts):
+            grammar.counters.attempts += 1
+            try:
+                skeleton = generator(grammar, lexicon, max_expansion_per_symbol=max_expansion_per_symbol,
+                                     max_recursion_depth=max_recursion_depth, print_out=False, rng=rng,
+                                     tracer=tracer, lexicalise=False)
+            except Exception as e:
+                grammar.counters.exception(e)
+                continue
+            if not grammar.counters.reject_length(len(skeleton), min_length, max_length):
+                if tracer is None:
+                    return skeleton, {"length": len(skeleton)}
+                tree = tracer.tree
+                return skeleton, {"length": len(skeleton), "depth": tree.depth(), "forced": tree.any_forced()}
+        raise ValueError(f"no skeleton of length {min_length}..{max_length} in {max_attempts} attempts")
+
+    return derive
+
+
+class SkeletonCache:
+    '''
+    Serves sentences from derived and cached skeletons, relexicalising each one up to `relexicalisations` times in a
+    row.
+    '''
+
+    def __init__(self, derive, grammar, relexicalisations=8, max_reuse=None, capacity=100000, max_skips=1000, reuse=0.0):
+        self.derive = derive
+        self.grammar = grammar
+        self.relexicalisations = relexicalisations
+        self.max_reuse = max_reuse
+        self.capacity = capacity
+        self.max_skips = max_skips
+        self.reuse = reuse
+        self.entries = OrderedDict()  # skeleton tuple -> [sentences produced, metadata], least recently used first
+        self.keys = []                # the cached skeletons again, for uniform picks
+        self.positions = {}           # skeleton tuple -> index in keys
+        self.derived = 0
+        self.served = 0
+        self.skipped = 0
+        self.evicted = 0
+
+    def _store(self, key, metadata):
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry[1] = metadata
+            self.entries.move_to_end(key)
+            return entry
+        entry = self.entries[key] = [0, metadata]
+        self.positions[key] = len(self.keys)
+        self.keys.append(key)
+        if len(self.entries) > self.capacity:
+            evicted, _ = self.entries.popitem(last=False)
+            index = self.positions.pop(evicted)
+            last = self.keys.pop()
+            if last != evicted:
+                self.keys[index] = last
+                self.positions[last] = index
+            self.evicted += 1
+        return entry
+
+    def _next_skeleton(self, rng):
+        counters = self.grammar.counters
+        for _ in range(self.max_skips):
+            if self.keys and self.reuse and rng.random() < self.reuse:
+                key = self.keys[rng.randrange(len(self.keys))]
+                entry = self.entries[key]
+                self.entries.move_to_end(key)
+                self.served += 1
+                counters.attempts += 1
+            else:
+                skeleton, metadata = self.derive(rng)
+                self.derived += 1
+                key = tuple(skeleton)
+                entry = self._store(key, metadata)
+            if self.max_reuse is None or entry[0] < self.max_reuse:
+                return key, entry
+            self.skipped += 1
+            counters.reject("max_reuse")
+        raise ValueError(f"{self.max_skips} skeletons in a row had reached max_reuse")
+
+    def iter_sentences(self, rng=random):
+        '''
+        Yields (words, metadata) forever.
+        '''
+        lexicalise = self.grammar.lexicalise
+        counters = self.grammar.counters
+        while True:
+            key, entry = self._next_skeleton(rng)
+            metadata = entry[1]
+            for i in range(self.relexicalisations):
+                if self.max_reuse is not None and entry[0] >= self.max_reuse:
+                    break
+                entry[0] += 1
+                if i:
+                    # the first sentence is the attempt that produced the skeleton
+                    counters.attempts += 1
+                counters.accepted += 1
+                yield lexicalise(key, rng), metadata
+
+    def stats(self):
+        return {"derived": self.derived, "served": self.served, "skipped": self.skipped, "cached": len(self.entries),
+                "evicted": self.evicted}
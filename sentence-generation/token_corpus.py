@@ -0,0 +1,207 @@
+'''
+Memory-mapped token-id corpora
+
+A text corpus has to be read and split line by line before any sentence can be used, and sentence k can only be
+found by reading everything before it. A token corpus stores the sentences of one tier as word ids instead, in three
+files next to each other:
+
+    {prefix}.tokens         every sentence's word ids back to back, uint16 (the closed vocabulary of the lexicon has a
+                            few hundred words)
+    {prefix}.offsets        uint64, sentence k is tokens[offsets[k]:offsets[k + 1]] (n + 1 entries)
+    {prefix}.vocab.json     the id -> word table, the sentence and token counts, and the settings of the export;
+                            written last, so a corpus without it is incomplete
+
+TokenCorpus opens the two arrays with np.memmap, so opening a corpus of 100M tokens reads nothing, corpus[k] is a
+zero-copy view of sentence k, and sample() draws random sentences by reading only their pages. Words are stored as
+in the lexicon (lower case, no period); text(k) formats them as the sentence_lists/ lines are (format_sentence).
+
+export_token_corpus writes a tier directly: skeletons from the tier's generator with lexicalise=False and the
+expansion budgets, rejecting those outside the length window as main_export_lists does (or, with --exact-length, from
+LengthSampler.sample_range, which is faster but has another mix of lengths; see length_sampler.py), lexicalised in
+batches by BatchLexicaliser, so no text is ever formed.
+
+    python token_corpus.py cf 1000000 corpora/cf --seed 1
+
+Needs NumPy (like batch_lexicaliser.py).
+'''
+
+import argparse
+import json
+import random
+
+import numpy as np
+
+from batch_lexicaliser import BatchLexicaliser
+from compiled_grammar import TERMINAL
+from length_sampler import LengthSampler
+from sentence_stream import format_sentence
+
+
+TOKEN_DTYPE = np.uint16
+OFFSET_DTYPE = np.uint64
+
+
+def corpus_vocabulary(lexicon, grammars=()):
+    '''
+    The id -> word table of a corpus: the words of the lexicon in order, then the terminals written in the rules of
+    the grammars (as CompiledGrammar.vocab is built, so it is the same table for every tier).
+    '''
+    vocab, seen = [], set()
+    words = [word for category in lexicon for word in lexicon[category]]
+    for grammar in grammars:
+        words += [name for sym, name in enumerate(grammar.names) if grammar.kind[sym] & TERMINAL]
+    for word in words:
+        if word not in seen:
+            seen.add(word)
+            vocab.append(word)
+    if len(vocab) > np.iinfo(TOKEN_DTYPE).max:
+        raise ValueError(f"{len(vocab)} words do not fit in {np.dtype(TOKEN_DTYPE).name} token ids")
+    return vocab
+
+
+class TokenCorpusWriter:
+    '''
+    Appends sentences (arrays of corpus word ids) to a new token corpus; close() writes the vocabulary file.
+    '''
+
+    def __init__(self, prefix, vocab, metadata=None):
+        self.prefix = prefix
+        self.vocab = vocab
+        self.ids = {word: i for i, word in enumerate(vocab)}
+        self.metadata = metadata or {}
+        self.tokens = open(prefix + ".tokens", "wb")
+        self.offsets = open(prefix + ".offsets", "wb")
+        self.sentences = 0
+        self.total = 0
+        np.zeros(1, dtype=OFFSET_DTYPE).tofile(self.offsets)
+
+    def write_batch(self, tokens, lengths):
+        '''
+        Appends len(lengths) sentences whose ids are concatenated in `tokens`.
+        '''
+        tokens = np.asarray(tokens, dtype=TOKEN_DTYPE)
+        lengths = np.asarray(lengths, dtype=OFFSET_DTYPE)
+        tokens.tofile(self.tokens)
+        (self.total + np.cumsum(lengths, dtype=OFFSET_DTYPE)).tofile(self.offsets)
+        self.sentences += len(lengths)
+        self.total += int(lengths.sum())
+
+    def write(self, words):
+        '''
+        Appends one sentence given as words.
+        '''
+        self.write_batch([self.ids[word] for word in words], [len(words)])
+
+    def close(self):
+        self.tokens.close()
+        self.offsets.close()
+        with open(self.prefix + ".vocab.json", "w") as file:
+            json.dump(dict(self.metadata, vocab=self.vocab, sentences=self.sentences, tokens=self.total,
+                           token_dtype=np.dtype(TOKEN_DTYPE).name, offset_dtype=np.dtype(OFFSET_DTYPE).name), file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TokenCorpus:
+    '''
+    A token corpus opened read-only with np.memmap.
+    '''
+
+    def __init__(self, prefix):
+        with open(prefix + ".vocab.json") as file:
+            self.metadata = json.load(file)
+        self.vocab = self.metadata["vocab"]
+        self.words_of = np.asarray(self.vocab, dtype=object)
+        self.offsets = np.memmap(prefix + ".offsets", dtype=self.metadata["offset_dtype"], mode="r")
+        self.tokens = (np.memmap(prefix + ".tokens", dtype=self.metadata["token_dtype"], mode="r")
+                       if self.metadata["tokens"] else np.zeros(0, dtype=self.metadata["token_dtype"]))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, k):
+        '''
+        Word ids of sentence k (a view into the memory map).
+        '''
+        return self.tokens[self.offsets[k]:self.offsets[k + 1]]
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def words(self, k):
+        return self.words_of[self[k]].tolist()
+
+    def text(self, k):
+        return format_sentence(self.words(k))
+
+    def sample(self, size, rng=None):
+        '''
+        (indices, sentences) of `size` uniformly drawn sentences; `rng` is a numpy Generator or a seed.
+        '''
+        indices = np.random.default_rng(rng).integers(0, len(self), size)
+        return indices, [self[k] for k in indices]
+
+
+def export_token_corpus(prefix, generator, grammar, lexicon, n, min_length=11, max_length=20, exact_length=False,
+                        seed=1, batch_size=100000, max_expansion_per_symbol=20, max_recursion_depth=10):
+    '''
+    Writes n sentences of one tier as a token corpus. As in main_export_lists, the skeletons come from the generator
+    with the expansion budgets by default, rejecting those outside the length window; with exact_length, from a
+    LengthSampler (the generator is then unused). Skeletons draw from random.Random(seed), words from
+    np.random.default_rng(seed). Returns the number of tokens written.
+    '''
+    rng = random.Random(seed)
+    word_rng = np.random.default_rng(seed)
+    lexicaliser = BatchLexicaliser(grammar)
+    vocab = corpus_vocabulary(lexicon, [grammar])
+    # grammar vocab id -> corpus id
+    to_corpus = np.asarray([vocab.index(word) for word in grammar.vocab], dtype=TOKEN_DTYPE)
+    sampler = LengthSampler(grammar, max_length) if exact_length else None
+
+    def skeleton():
+        if sampler is not None:
+            return sampler.sample_range(min_length, max_length, rng)
+        while True:
+            try:
+                symbols = generator(grammar, lexicon, max_expansion_per_symbol=max_expansion_per_symbol,
+                                    max_recursion_depth=max_recursion_depth, print_out=False, rng=rng,
+                                    lexicalise=False)
+            except Exception as e:
+                grammar.counters.exception(e)
+                continue
+            if not grammar.counters.reject_length(len(symbols), min_length, max_length):
+                return symbols
+
+    metadata = {"min_length": min_length, "max_length": max_length, "seed": seed,
+                "exact_length": exact_length}
+    with TokenCorpusWriter(prefix, vocab, metadata) as writer:
+        for start in range(0, n, batch_size):
+            skeletons = [skeleton() for _ in range(min(batch_size, n - start))]
+            lengths = [len(symbols) for symbols in skeletons]
+            flat = np.fromiter((sym for symbols in skeletons for sym in symbols), dtype=np.int32, count=sum(lengths))
+            writer.write_batch(to_corpus[lexicaliser.draw(flat, word_rng)], lengths)
+        return writer.total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("tier", choices=["cf", "ix", "cs"])
+    parser.add_argument("n", type=int)
+    parser.add_argument("prefix")
+    parser.add_argument("--min-length", type=int, default=11)
+    parser.add_argument("--max-length", type=int, default=20)
+    parser.add_argument("--exact-length", action="store_true",
+                        help="draw skeletons at a length in the window with a LengthSampler instead of rejecting by length")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    from main import lexicon, tiers
+    generator, grammar = tiers[args.tier]
+    total = export_token_corpus(args.prefix, generator, grammar, lexicon, args.n, args.min_length, args.max_length,
+                                args.exact_length, args.seed)
+    print(f"{args.n} {args.tier.upper()} sentences, {total} tokens -> {args.prefix}.tokens")